@@ -0,0 +1,251 @@
+"""Background access logging for the recognition server.
+
+Connection threads only put records on a queue. A single writer thread keeps
+access_log.txt open, writes lines in batches (flushing on a size or time
+threshold), rotates the file when it grows too large, and can mirror every
+record into an indexed SQLite database for range queries:
+
+    python access_log.py --db access_log.db --since "2024-05-01 08:00" --until "2024-05-01 18:00"
+"""
+import argparse
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+ACCESS_LOG_FILE = "access_log.txt"
+BATCH_SIZE = 100  # Records written per flush at most
+FLUSH_INTERVAL = 1.0  # Seconds a record may wait in memory before being flushed
+STREAK_INTERVAL = 10.0  # Seconds of repeated DENIED events collapsed into one record at most
+MAX_BYTES = 10 * 1024 * 1024  # Rotate the text log beyond this size
+BACKUP_COUNT = 5  # Rotated files kept as access_log.txt.1 ... .5
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS access_events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    camera TEXT NOT NULL,
+    granted INTEGER NOT NULL,
+    names TEXT NOT NULL,
+    repeat_count INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS access_events_ts ON access_events (ts);
+CREATE INDEX IF NOT EXISTS access_events_granted_ts ON access_events (granted, ts);
+"""
+
+
+class AccessRecord:
+    def __init__(self, ts, camera, granted, names, repeat_count=1):
+        self.ts = ts
+        self.camera = camera
+        self.granted = granted
+        self.names = names
+        self.repeat_count = repeat_count
+
+    def format(self):
+        timestamp = time.strftime(TIME_FORMAT, time.localtime(self.ts))
+        if self.granted:
+            return f"{timestamp}: Access GRANTED for {', '.join(self.names) or 'Unknown'} from {self.camera}\n"
+        line = f"{timestamp}: Access DENIED for unknown person from {self.camera}"
+        if self.repeat_count > 1:
+            line += f" (repeated {self.repeat_count} times)"
+        return line + "\n"
+
+
+class AccessLogger:
+    """Queue-fed access log writer with batching, rotation and optional SQLite.
+
+    Consecutive DENIED events from the same camera are collapsed: the first
+    one is written immediately, and the rest are written as a single
+    "(repeated N times)" record once the streak ends: on a GRANTED event,
+    when the camera disconnects (end_camera) or after streak_interval seconds.
+    """
+
+    def __init__(self, path=ACCESS_LOG_FILE, sqlite_path=None, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT,
+                 streak_interval=STREAK_INTERVAL):
+        self.path = path
+        self.sqlite_path = sqlite_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.streak_interval = streak_interval
+        self.records = queue.Queue()
+        # camera -> [first DENIED record, number of suppressed repeats, monotonic start], oldest first
+        self.denied_streaks = {}
+        self.records_logged = 0
+        self.records_deduplicated = 0
+        # Opened here so a bad path fails the caller instead of silently killing the writer thread
+        self.log_file = self._open_file()
+        self.database = None
+        if sqlite_path:
+            try:
+                # Only the writer thread uses the connection from here on
+                self.database = sqlite3.connect(sqlite_path, check_same_thread=False)
+                self.database.executescript(SCHEMA)
+            except Exception:
+                self.log_file.close()
+                if self.database is not None:
+                    self.database.close()
+                raise
+
+        self.thread = threading.Thread(target=self._run, name="access-log")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def log(self, granted, names, camera, ts=None):
+        """Queue one access decision; never blocks on disk I/O"""
+        self.records.put(AccessRecord(time.time() if ts is None else ts, str(camera), granted, list(names)))
+
+    def end_camera(self, camera):
+        """Write out the camera's DENIED streak, e.g. when its connection closes"""
+        self.records.put(str(camera))
+
+    def close(self):
+        self.records.put(None)
+        self.thread.join()
+
+    def stats(self):
+        return {"queued": self.records.qsize(), "logged": self.records_logged,
+                "deduplicated": self.records_deduplicated}
+
+    def _deduplicate(self, record, batch):
+        streak = self.denied_streaks.get(record.camera)
+        if not record.granted:
+            if streak is not None:
+                streak[1] += 1
+                self.records_deduplicated += 1
+                return
+            self.denied_streaks[record.camera] = [record, 0, time.monotonic()]
+        elif streak is not None:
+            self._end_streak(record.camera, batch)
+        batch.append(record)
+
+    def _end_streak(self, camera, batch):
+        first, repeats, _ = self.denied_streaks.pop(camera)
+        if repeats:
+            batch.append(AccessRecord(first.ts, camera, False, first.names, repeats))
+
+    def _open_file(self):
+        return open(self.path, "a")
+
+    def _rotate(self, log_file):
+        log_file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        return self._open_file()
+
+    def _end_old_streaks(self, batch):
+        now = time.monotonic()
+        for camera, (_, _, started) in list(self.denied_streaks.items()):
+            if now - started < self.streak_interval:
+                break
+            self._end_streak(camera, batch)
+
+    def _next_wakeup(self, deadline):
+        """Monotonic time the writer must wake up by, or None to wait for the next record"""
+        if not self.denied_streaks:
+            return deadline
+        streak_end = next(iter(self.denied_streaks.values()))[2] + self.streak_interval
+        return streak_end if deadline is None else min(deadline, streak_end)
+
+    def _write(self, log_file, database, batch):
+        log_file.write("".join(record.format() for record in batch))
+        log_file.flush()
+        if database is not None:
+            with database:
+                database.executemany(
+                    "INSERT INTO access_events (ts, camera, granted, names, repeat_count) VALUES (?, ?, ?, ?, ?)",
+                    [(r.ts, r.camera, int(r.granted), ", ".join(r.names), r.repeat_count) for r in batch])
+        self.records_logged += len(batch)
+        if log_file.tell() >= self.max_bytes:
+            log_file = self._rotate(log_file)
+        return log_file
+
+    def _run(self):
+        log_file, database = self.log_file, self.database
+        batch = []
+        deadline = None
+        closing = False
+        try:
+            while not closing:
+                wakeup = self._next_wakeup(deadline)
+                timeout = None if wakeup is None else max(0.0, wakeup - time.monotonic())
+                try:
+                    record = self.records.get(timeout=timeout)
+                except queue.Empty:
+                    record = False
+
+                if record is None:
+                    closing = True
+                    for camera in list(self.denied_streaks):
+                        self._end_streak(camera, batch)
+                elif isinstance(record, str):
+                    # The camera disconnected
+                    if record in self.denied_streaks:
+                        self._end_streak(record, batch)
+                elif record:
+                    self._deduplicate(record, batch)
+                self._end_old_streaks(batch)
+                if batch and deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+                due = deadline is not None and time.monotonic() >= deadline
+                if batch and (closing or due or len(batch) >= self.batch_size):
+                    try:
+                        log_file = self._write(log_file, database, batch)
+                    except Exception as e:
+                        print(f"❌ Error writing access log: {e}")
+                    batch = []
+                    deadline = None
+        finally:
+            log_file.close()
+            if database is not None:
+                database.close()
+
+
+def query_access(sqlite_path, since, until, granted=True):
+    """(time, camera, names, repeat_count) rows logged between two epoch times"""
+    with sqlite3.connect(sqlite_path) as database:
+        rows = database.execute(
+            "SELECT ts, camera, names, repeat_count FROM access_events "
+            "WHERE granted = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+            (int(granted), since, until)).fetchall()
+    return [(time.strftime(TIME_FORMAT, time.localtime(ts)), camera, names, count)
+            for ts, camera, names, count in rows]
+
+
+def parse_time(value):
+    for fmt in (TIME_FORMAT, "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"Unrecognized time {value!r}, expected YYYY-MM-DD[ HH:MM[:SS]]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", required=True, help="SQLite access database written by server.py --access-db")
+    parser.add_argument("--since", type=parse_time, default=0.0)
+    parser.add_argument("--until", type=parse_time, default=None)
+    parser.add_argument("--denied", action="store_true", help="List denied attempts instead of entries")
+    args = parser.parse_args()
+
+    until = time.time() if args.until is None else args.until
+    for timestamp, camera, names, count in query_access(args.db, args.since, until, not args.denied):
+        suffix = f" (x{count})" if count > 1 else ""
+        print(f"{timestamp}  {camera}  {names}{suffix}")
+
+
+if __name__ == "__main__":
+    main()
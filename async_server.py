@@ -0,0 +1,124 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import registry
+from protocol import HEADER, MAX_FRAME_SIZE, PROTOCOL_PROBE, forwarded_camera, is_probe, negotiate, pack_hello
+from recognition import add_feedback
+
+MAX_CONNECTIONS = 256
+EXECUTOR_WORKERS = os.cpu_count() or 4
+
+
+class AsyncRecognitionServer:
+    """asyncio front end speaking the same >L length-prefixed protocol as handle_client.
+
+    Idle or slow cameras only cost a coroutine. Each connection keeps at most
+    one frame in flight: the next frame is not read until the previous result
+    has been written and drained, so a busy server pushes back on clients
+    through TCP instead of buffering frames. Recognition and logging run on a
+    thread pool executor so the event loop never blocks on CPU work.
+    """
+
+    def __init__(self, recognizer, handle_result, max_connections=MAX_CONNECTIONS,
+                 executor_workers=EXECUTOR_WORKERS, profiles=None, end_connection=None):
+        self.recognizer = recognizer
+        self.handle_result = handle_result
+        # Called with the camera's address once its connection is closed, e.g. to end its access log streak
+        self.end_connection = end_connection
+        self.profiles = profiles
+        self.max_connections = max_connections
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="recognition")
+        self.active_connections = 0
+        self.rejected_connections = 0
+        self.frames_processed = 0
+
+    def _process_frame(self, frame_data, addr, session, encoder, frame_seq, received_at):
+        result = self.recognizer.recognize_encoded(frame_data, session)
+        if result is None:
+            print("⚠️ Frame decoding failed, skipping frame.")
+            return None
+        result = add_feedback(result, frame_seq, received_at, self.recognizer.queue_depth())
+        return self.handle_result(result, addr, encoder)
+
+    async def handle_camera(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        if self.active_connections >= self.max_connections:
+            self.rejected_connections += 1
+            print(f"⛔ Connection limit ({self.max_connections}) reached, rejecting {addr}")
+            writer.close()
+            return
+
+        self.active_connections += 1
+        loop = asyncio.get_running_loop()
+        session = None
+        encoder = None
+        frame_seq = 0
+        try:
+            while True:
+                received = time.perf_counter()
+                frame_size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+                if frame_size > MAX_FRAME_SIZE:
+                    print(f"⚠️ Frame of {frame_size} bytes from {addr} exceeds limit, closing")
+                    break
+                frame_data = await reader.readexactly(frame_size)
+                registry.observe("recv", received)
+
+                # The first message may be a health probe or a protocol handshake instead of a frame
+                if encoder is None:
+                    if is_probe(frame_data):
+                        writer.write(pack_hello(PROTOCOL_PROBE))
+                        await writer.drain()
+                        break
+                    # Behind balancer.py, log and pick the profile by the camera's own address
+                    addr = forwarded_camera(frame_data) or addr
+                    print(f"📥 Connection from {addr}")
+                    session = self.recognizer.open_session(self.profiles.for_camera(addr) if self.profiles else None)
+                    encoder, reply = negotiate(frame_data)
+                    if reply is not None:
+                        writer.write(reply)
+                        await writer.drain()
+                        continue
+
+                frame_seq += 1
+                response = await loop.run_in_executor(self.executor, self._process_frame, frame_data, addr,
+                                                      session, encoder, frame_seq, time.perf_counter())
+                self.frames_processed += 1
+                if response is not None:
+                    sending = time.perf_counter()
+                    writer.write(response)
+                    await writer.drain()
+                    registry.observe("sendall", sending)
+        except asyncio.IncompleteReadError:
+            print("❌ Disconnected")
+        except Exception as e:
+            # Recognizer failures end this camera's connection, like the threaded handler
+            print(f"💥 Error: {e}")
+        finally:
+            self.active_connections -= 1
+            if session is not None:
+                self.recognizer.close_session(session)
+            registry.close_connection(addr)
+            if self.end_connection is not None:
+                self.end_connection(addr)
+            writer.close()
+
+    def stats(self):
+        return {
+            "active_connections": self.active_connections,
+            "rejected_connections": self.rejected_connections,
+            "frames": self.frames_processed,
+        }
+
+    async def serve(self, port):
+        server = await asyncio.start_server(self.handle_camera, host="", port=port, reuse_address=True)
+        print(f"🚀 Async server listening on port {port} (max {self.max_connections} connections)")
+        async with server:
+            await server.serve_forever()
+
+    def run(self, port):
+        try:
+            asyncio.run(self.serve(port))
+        finally:
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,361 @@
+"""Front-end load balancer for a pool of recognition servers.
+
+Cameras connect to the balancer exactly as they would to server.py. Each
+camera is relayed to the healthy backend with the fewest outstanding
+frames (forwarded but not yet answered):
+
+    python balancer.py --backend 10.0.0.2:9999 --backend 10.0.0.3:9999 --port 9999
+
+Backends are health-checked with a probe handshake every few seconds. When a
+backend fails mid-stream, the camera's connection stays up: the balancer
+connects it to another backend, replays its protocol handshake, and
+renumbers responses so frame_seq keeps counting up for the camera. Frames
+in flight on the failed backend are lost, and face tracks start afresh on
+the new one.
+
+The handshake sent to backends carries the camera's address, so their access
+logs and detection profiles see the camera rather than the balancer. Backends
+take that address at face value: only the balancer and cameras should be able
+to reach them.
+"""
+import argparse
+import json
+import socket
+import threading
+import time
+
+from protocol import (FrameReader, PROTOCOL_JSON, PROTOCOL_PROBE, pack_hello, pack_message, parse_hello,
+                      renumber_response)
+
+PORT = 9999
+HEALTH_INTERVAL = 5.0  # Seconds between backend health checks
+CONNECT_TIMEOUT = 2.0  # Seconds to connect and finish the handshake with a backend
+STATS_INTERVAL = 30  # Seconds between backend statistics reports
+
+
+class Backend:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.healthy = True
+        self.outstanding = 0
+        self.cameras = 0
+        self.frames = 0
+        self.failures = 0
+
+    def __str__(self):
+        return f"{self.host}:{self.port}"
+
+
+class BackendPool:
+    """Picks backends by least outstanding frames and tracks their health"""
+
+    def __init__(self, backends, health_interval=HEALTH_INTERVAL):
+        self.backends = backends
+        self.health_interval = health_interval
+        self.lock = threading.Lock()
+        self.running = True
+        self.checker = threading.Thread(target=self._check_health, name="health-check")
+        self.checker.daemon = True
+
+    def acquire(self, exclude=()):
+        """Least loaded healthy backend not in exclude; raises ConnectionError if there is none"""
+        with self.lock:
+            candidates = [backend for backend in self.backends if backend.healthy and backend not in exclude]
+            if not candidates:
+                raise ConnectionError("No healthy recognition backend available")
+            backend = min(candidates, key=lambda b: (b.outstanding, b.cameras))
+            backend.cameras += 1
+            return backend
+
+    def release(self, backend, unanswered=0):
+        with self.lock:
+            backend.cameras -= 1
+            backend.outstanding -= unanswered
+
+    def sent(self, backend):
+        with self.lock:
+            backend.outstanding += 1
+            backend.frames += 1
+
+    def answered(self, backend, count):
+        with self.lock:
+            backend.outstanding -= count
+
+    def mark_down(self, backend):
+        with self.lock:
+            if backend.healthy:
+                print(f"🔴 Backend {backend} is down")
+            backend.healthy = False
+            backend.failures += 1
+
+    def _probe(self, backend):
+        """Health probe handshake; servers answer it without opening a recognition session"""
+        try:
+            with socket.create_connection((backend.host, backend.port), timeout=CONNECT_TIMEOUT) as sock:
+                sock.sendall(pack_hello(PROTOCOL_PROBE))
+                reply = FrameReader(sock).read_message()
+                return reply is not None and parse_hello(reply) is not None
+        except (OSError, ValueError):
+            return False
+
+    def _check_health(self):
+        while self.running:
+            for backend in self.backends:
+                healthy = self._probe(backend)
+                with self.lock:
+                    if healthy and not backend.healthy:
+                        print(f"🟢 Backend {backend} is back up")
+                    elif not healthy and backend.healthy:
+                        print(f"🔴 Backend {backend} failed its health check")
+                        backend.failures += 1
+                    backend.healthy = healthy
+            time.sleep(self.health_interval)
+
+    def start(self):
+        self.checker.start()
+
+    def stats(self):
+        with self.lock:
+            return {str(backend): {"healthy": backend.healthy, "cameras": backend.cameras,
+                                   "outstanding": backend.outstanding, "frames": backend.frames,
+                                   "failures": backend.failures}
+                    for backend in self.backends}
+
+
+class CameraRelay:
+    """Relays one camera connection to a backend, failing over when it dies.
+
+    The camera's frames are forwarded on the connection thread; a second
+    thread per backend connection relays responses back. Responses from a
+    backend count its own frames, so their frame_seq is shifted by the
+    number of frames the camera had sent before it was attached.
+    """
+
+    def __init__(self, conn, addr, pool):
+        self.conn = conn
+        self.addr = addr
+        self.pool = pool
+        # Protocol version the camera asked for in its handshake, None for cameras that send frames straight away
+        self.hello = None
+        self.version = PROTOCOL_JSON
+        # Set once the first backend has answered the handshake; later backends must agree with it
+        self.negotiated = False
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.running = True
+        self.backend = None
+        self.backend_conn = None
+        self.frames = 0
+        self.seq_offset = 0
+        self.backend_frames = 0
+        self.backend_acked = 0
+        self.failovers = 0
+
+    def _connect(self, backend):
+        """Connect to backend and replay the handshake; returns (socket, reader, handshake reply)"""
+        sock = socket.create_connection((backend.host, backend.port), timeout=CONNECT_TIMEOUT)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            reader = FrameReader(sock)
+            # Always say hello to pass on the camera's address; cameras without a handshake get JSON
+            requested = PROTOCOL_JSON if self.hello is None else self.hello
+            sock.sendall(pack_hello(requested, self.addr))
+            reply = reader.read_message()
+            if reply is None:
+                raise ConnectionError("closed during the handshake")
+            reply = bytes(reply)
+            version = parse_hello(reply)
+            if version is None:
+                raise ConnectionError("did not answer the protocol handshake")
+            if self.negotiated and version != self.version:
+                # The camera's decoder is fixed, this backend is of no use to it
+                raise ValueError(f"negotiated protocol {version}, the camera uses {self.version}")
+            self.version = version
+            self.negotiated = True
+            sock.settimeout(None)
+            return sock, reader, reply
+        except Exception:
+            sock.close()
+            raise
+
+    def _attach(self, exclude=()):
+        """Move the camera to the least loaded healthy backend; returns the handshake reply"""
+        tried = set(exclude)
+        while True:
+            backend = self.pool.acquire(tried)
+            try:
+                sock, reader, reply = self._connect(backend)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Could not attach {self.addr} to backend {backend}: {e}")
+                self.pool.release(backend)
+                if isinstance(e, OSError):
+                    self.pool.mark_down(backend)
+                tried.add(backend)
+                continue
+            self.backend, self.backend_conn = backend, sock
+            self.seq_offset = self.frames
+            self.backend_frames = self.backend_acked = 0
+            thread = threading.Thread(target=self._relay_responses, args=(sock, reader, backend),
+                                      name=f"responses-{self.addr}")
+            thread.daemon = True
+            thread.start()
+            return reply
+
+    def _detach(self):
+        """Release the current backend connection; call with self.lock held"""
+        if self.backend is None:
+            return
+        self.pool.release(self.backend, self.backend_frames - self.backend_acked)
+        try:
+            self.backend_conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.backend_conn.close()
+        self.backend = self.backend_conn = None
+
+    def _failover(self, dead_conn):
+        with self.lock:
+            if dead_conn is not self.backend_conn or not self.running:
+                # Already replaced, or the camera is leaving anyway
+                return
+            failed = self.backend
+            self.pool.mark_down(failed)
+            self._detach()
+            try:
+                self._attach(exclude={failed})
+            except ConnectionError as e:
+                print(f"💥 {self.addr}: {e}, closing the camera connection")
+                self._close_camera()
+                return
+            self.failovers += 1
+            print(f"🔀 {self.addr} failed over from {failed} to {self.backend}")
+
+    def _close_camera(self):
+        self.running = False
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _relay_responses(self, sock, reader, backend):
+        while True:
+            try:
+                payload = reader.read_message()
+            except (OSError, ValueError):
+                payload = None
+            if payload is None:
+                break
+            with self.lock:
+                if sock is not self.backend_conn:
+                    return
+                offset = self.seq_offset
+            message, frame_seq = renumber_response(payload, self.version, offset)
+            if frame_seq is not None or self.version == PROTOCOL_JSON:
+                with self.lock:
+                    # A response also answers the stale frames the backend dropped before it
+                    acked = frame_seq - offset if frame_seq is not None else self.backend_acked + 1
+                    if sock is self.backend_conn and acked > self.backend_acked:
+                        self.pool.answered(backend, acked - self.backend_acked)
+                        self.backend_acked = acked
+            try:
+                with self.send_lock:
+                    self.conn.sendall(pack_message(message))
+            except OSError:
+                self._close_camera()
+                return
+        self._failover(sock)
+
+    def _forward(self, frame_data):
+        with self.lock:
+            sock, backend = self.backend_conn, self.backend
+            if sock is None:
+                return False
+            self.frames += 1
+            self.backend_frames += 1
+            self.pool.sent(backend)
+        try:
+            sock.sendall(pack_message(frame_data))
+        except OSError:
+            # The frame is lost; later frames go to the replacement backend
+            self._failover(sock)
+        return True
+
+    def run(self):
+        print(f"📥 Camera {self.addr}")
+        reader = FrameReader(self.conn)
+        try:
+            first = reader.read_message()
+            if first is None:
+                return
+            self.hello = parse_hello(first)
+            with self.lock:
+                reply = self._attach()
+            print(f"➡️ {self.addr} -> {self.backend}")
+            if self.hello is not None:
+                with self.send_lock:
+                    self.conn.sendall(pack_message(reply))
+            elif not self._forward(first):
+                return
+            while self.running:
+                frame_data = reader.read_message()
+                if frame_data is None or not self._forward(frame_data):
+                    break
+        except (OSError, ValueError) as e:
+            print(f"💥 {self.addr}: {e}")
+        finally:
+            with self.lock:
+                self.running = False
+                self._detach()
+            self.conn.close()
+            print(f"❌ Camera {self.addr} disconnected after {self.frames} frames, {self.failovers} failovers")
+
+
+def parse_backend(value):
+    host, _, port = value.rpartition(":")
+    if not host:
+        raise argparse.ArgumentTypeError(f"Expected HOST:PORT, got {value!r}")
+    return Backend(host, int(port))
+
+
+def report_stats(pool):
+    while True:
+        time.sleep(STATS_INTERVAL)
+        print(f"📊 Backends: {json.dumps(pool.stats())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", type=parse_backend, action="append", required=True,
+                        help="Recognition server as HOST:PORT (repeat for each server)")
+    parser.add_argument("--port", type=int, default=PORT, help="Port cameras connect to")
+    parser.add_argument("--health-interval", type=float, default=HEALTH_INTERVAL)
+    args = parser.parse_args()
+
+    pool = BackendPool(args.backend, args.health_interval)
+    pool.start()
+    stats_thread = threading.Thread(target=report_stats, args=(pool,))
+    stats_thread.daemon = True
+    stats_thread.start()
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind(('', args.port))
+    server_socket.listen(64)
+    print(f"⚖️ Balancing cameras on port {args.port} across {', '.join(map(str, args.backend))}")
+    try:
+        while True:
+            conn, addr = server_socket.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            relay_thread = threading.Thread(target=CameraRelay(conn, addr, pool).run)
+            relay_thread.daemon = True
+            relay_thread.start()
+    except KeyboardInterrupt:
+        print("🛑 Balancer shutting down...")
+    finally:
+        pool.running = False
+        server_socket.close()
+
+
+if __name__ == "__main__":
+    main()
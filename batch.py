@@ -0,0 +1,211 @@
+"""Offline recognition over recorded footage, without the socket loop.
+
+Runs the server's detection, encoding and matching code on a video file or
+a directory of images and writes one row per processed frame:
+
+    python batch.py --video lobby.mp4 --stride 5 --jobs 8 --output lobby.jsonl
+    python batch.py --frames snapshots/ --output audit.csv
+
+The input is split into chunks of consecutive frames. Each worker process
+opens the video itself, seeks to its chunk and decodes it, so decoding
+runs in parallel as well as recognition. Results stream back in frame
+order and are written as they arrive, so hours of footage never sit in
+memory. Only every --stride-th frame is decoded in full and recognized.
+Within a chunk, faces are tracked and unchanged scenes are skipped exactly
+as they are for a live camera, except that the motion gate, track
+identities and cached results expire on video time rather than wall-clock
+time, so the output does not depend on how fast the machine runs.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+
+import cv2
+
+CHUNK_FRAMES = 300  # Consecutive video frames handed to a worker at a time
+CHUNK_IMAGES = 32  # Images handed to a worker at a time
+PROGRESS_INTERVAL = 10  # Seconds between progress reports
+FRAME_INTERVAL = 1.0  # Seconds between images, or frames of a video without a frame rate, for expiry times
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+CSV_FIELDS = ["frame", "time", "source", "faces_detected", "recognized", "access_granted", "cached",
+              "face_locations"]
+
+# Loaded once per worker process by _init_worker
+_recognizer = None
+
+
+def video_chunks(path, stride, chunk_frames=CHUNK_FRAMES):
+    """("video", path, first frame, end frame, fps, stride) tasks covering the whole video"""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video {path}")
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+    capture.release()
+    if frame_count <= 0:
+        # Unknown length (some streams do not report it), decode it sequentially
+        return [("video", path, 0, None, fps, stride)]
+    # Chunks start on a sampled frame so the stride stays uniform across chunk borders
+    chunk_frames = max(stride, chunk_frames - chunk_frames % stride)
+    return [("video", path, start, min(start + chunk_frames, frame_count), fps, stride)
+            for start in range(0, frame_count, chunk_frames)]
+
+
+def image_chunks(directory, stride, chunk_images=CHUNK_IMAGES):
+    """Tasks of (frame number, path) lists over every stride-th image of directory, sorted by name"""
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+    images = [(i, os.path.join(directory, name)) for i, name in enumerate(names)][::stride]
+    return [("images", images[start:start + chunk_images]) for start in range(0, len(images), chunk_images)]
+
+
+def iter_video_frames(path, start, end, stride):
+    """(frame number, BGR frame) for every stride-th frame in [start, end)"""
+    capture = cv2.VideoCapture(path)
+    try:
+        if start:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        index = start
+        while end is None or index < end:
+            if index % stride == 0:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield index, frame
+            # Skipped frames are only grabbed, not converted to BGR
+            elif not capture.grab():
+                break
+            index += 1
+    finally:
+        capture.release()
+
+
+def iter_image_frames(images):
+    for index, path in images:
+        frame = cv2.imread(path)
+        if frame is None:
+            print(f"⚠️ Could not read {path}, skipping")
+            continue
+        yield index, frame
+
+
+def _init_worker(session_options):
+    global _recognizer
+    # Imported here so the parent process only reads the input and writes results
+    from recognition import FrameRecognizer
+    from server import load_gallery
+    _recognizer = FrameRecognizer(load_gallery(), session_options)
+
+
+def process_chunk(task):
+    """Recognize every frame of one chunk; returns its rows in frame order"""
+    session = _recognizer.open_session()
+    if task[0] == "video":
+        _, path, start, end, fps, stride = task
+        frames = iter_video_frames(path, start, end, stride)
+        source = os.path.basename(path)
+    else:
+        frames = iter_image_frames(task[1])
+        fps, paths = 0.0, dict(task[1])
+
+    rows = []
+    for index, frame in frames:
+        frame_time = index / fps if fps else index * FRAME_INTERVAL
+        result = _recognizer.recognize(frame, session, now=frame_time)
+        rows.append({
+            "frame": index,
+            "time": round(frame_time, 3) if fps else None,
+            "source": source if task[0] == "video" else os.path.basename(paths[index]),
+            "faces_detected": result["faces_detected"],
+            "recognized": result["recognized"],
+            "access_granted": result["access_granted"],
+            "cached": result["cached"],
+            "face_locations": result["face_locations"],
+        })
+    return rows
+
+
+def recognize_chunks(tasks, jobs, session_options):
+    """Stream result rows for tasks in order, processing up to jobs chunks at once"""
+    if jobs <= 1:
+        _init_worker(session_options)
+        for task in tasks:
+            yield from process_chunk(task)
+        return
+    with multiprocessing.get_context().Pool(jobs, initializer=_init_worker, initargs=(session_options,)) as pool:
+        for rows in pool.imap(process_chunk, tasks):
+            yield from rows
+
+
+class ResultWriter:
+    """Writes rows as JSON lines, or as CSV when the output file ends in .csv"""
+
+    def __init__(self, path):
+        self.file = open(path, "w", newline="")
+        self.csv = None
+        if path.lower().endswith(".csv"):
+            self.csv = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            self.csv.writeheader()
+
+    def write(self, row):
+        if self.csv is None:
+            self.file.write(json.dumps(row) + "\n")
+        else:
+            self.csv.writerow(dict(row, recognized=";".join(row["recognized"]),
+                                   face_locations=json.dumps(row["face_locations"])))
+
+    def close(self):
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--video", help="Video file to process")
+    source.add_argument("--frames", help="Directory of images to process")
+    parser.add_argument("--output", required=True, help="Results file (.jsonl, or .csv)")
+    parser.add_argument("--stride", type=int, default=1, help="Process every Nth frame")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--no-motion-gate", action="store_true",
+                        help="Run detection on every sampled frame, even when the scene has not changed")
+    args = parser.parse_args()
+    stride = max(1, args.stride)
+
+    if args.video:
+        tasks = video_chunks(args.video, stride)
+        fps = tasks[0][4]
+    else:
+        tasks = image_chunks(args.frames, stride)
+        fps = 0.0
+    session_options = {"motion_gating": not args.no_motion_gate}
+    print(f"🎞️ Processing {len(tasks)} chunks with {args.jobs} workers, every {stride} frame(s)")
+
+    writer = ResultWriter(args.output)
+    start = time.perf_counter()
+    next_report = start + PROGRESS_INTERVAL
+    frames = granted = 0
+    last_frame = 0
+    try:
+        for row in recognize_chunks(tasks, args.jobs, session_options):
+            writer.write(row)
+            frames += 1
+            granted += row["access_granted"]
+            last_frame = row["frame"]
+            if time.perf_counter() >= next_report:
+                next_report += PROGRESS_INTERVAL
+                elapsed = time.perf_counter() - start
+                speed = f", {last_frame / fps / elapsed:.1f}x real time" if fps else ""
+                print(f"⏱️ {frames} frames in {elapsed:.0f}s ({frames / elapsed:.1f} fps{speed})")
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    speed = f" ({(last_frame + 1) / fps / elapsed:.1f}x real time)" if fps and elapsed else ""
+    print(f"✅ Processed {frames} frames in {elapsed:.1f}s{speed}, access granted on {granted}")
+    print(f"💾 Wrote results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Receive-path micro-benchmark: FrameReader against the old += concatenation loop.
+
+Streams length-prefixed frames over a local socket pair and reports MB/s, plus
+the transient bytes allocated per frame (traced with tracemalloc on a separate
+run, so tracing overhead does not skew the throughput numbers):
+
+    python bench_framing.py --frame-size 60000 --frames 2000
+"""
+import argparse
+import json
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from protocol import FrameReader, pack_message
+
+
+def legacy_reader(conn):
+    """The receive loop handle_client and receive_responses used before FrameReader"""
+    data_buffer = b""
+    while True:
+        while len(data_buffer) < 4:
+            packet = conn.recv(4096)
+            if not packet:
+                return
+            data_buffer += packet
+        frame_size = struct.unpack(">L", data_buffer[:4])[0]
+        data_buffer = data_buffer[4:]
+        while len(data_buffer) < frame_size:
+            data_buffer += conn.recv(4096)
+        frame_data = data_buffer[:frame_size]
+        data_buffer = data_buffer[frame_size:]
+        yield frame_data
+
+
+def frame_reader(conn):
+    reader = FrameReader(conn)
+    while True:
+        frame_data = reader.read_message()
+        if frame_data is None:
+            return
+        yield frame_data
+
+
+def run(read_frames, message, frames, trace):
+    """Receive frames; returns elapsed seconds and, when traced, transient bytes allocated per frame"""
+    receiver, sender = socket.socketpair()
+
+    def send():
+        for _ in range(frames):
+            sender.sendall(message)
+        sender.close()
+
+    thread = threading.Thread(target=send)
+    thread.start()
+    if trace:
+        tracemalloc.start()
+    allocated = 0
+    received = 0
+    frames_iter = read_frames(receiver)
+    start = time.perf_counter()
+    while True:
+        if trace:
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        frame_data = next(frames_iter, None)
+        if frame_data is None:
+            break
+        # Same handoff the server does before cv2.imdecode
+        np.frombuffer(frame_data, dtype=np.uint8)
+        if trace:
+            # Peak above the starting point is what this frame had to allocate
+            allocated += tracemalloc.get_traced_memory()[1] - baseline
+        received += 1
+    elapsed = time.perf_counter() - start
+    if trace:
+        tracemalloc.stop()
+    thread.join()
+    receiver.close()
+    assert received == frames
+    return elapsed, allocated / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frame-size", type=int, default=60000, help="Payload bytes (a 0.3x 720p JPEG is ~30-60 KB)")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--traced-frames", type=int, default=200)
+    args = parser.parse_args()
+
+    message = pack_message(bytes(args.frame_size))
+    results = {"frame_size": args.frame_size, "frames": args.frames}
+    for name, read_frames in (("legacy", legacy_reader), ("frame_reader", frame_reader)):
+        elapsed, _ = run(read_frames, message, args.frames, trace=False)
+        _, allocated = run(read_frames, message, args.traced_frames, trace=True)
+        results[name] = {
+            "mb_per_second": args.frame_size * args.frames / elapsed / 1e6,
+            "us_per_frame": elapsed * 1e6 / args.frames,
+            "allocated_bytes_per_frame": allocated,
+            "allocated_frame_copies": allocated / args.frame_size,
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
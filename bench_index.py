@@ -0,0 +1,98 @@
+"""Recall and latency of the approximate face indexes against exact matching.
+
+Runs on a synthetic gallery shaped like dlib encodings (clustered 128-d
+vectors) so it does not need a real face database:
+
+    python bench_index.py --identities 100000 --queries 500
+
+With --samples N every identity is enrolled N times, and the identity
+(centroid shortlist) index is measured as well:
+
+    python bench_index.py --identities 5000 --samples 20
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from face_index import FlatIndex, IdentityIndex, IVFIndex
+
+
+def synthetic_gallery(identities, dim, seed):
+    rng = np.random.default_rng(seed)
+    # Real encodings are not uniform; group identities around a few hundred "looks"
+    groups = rng.normal(0.0, 0.08, size=(max(1, identities // 200), dim))
+    members = groups[rng.integers(0, len(groups), identities)]
+    return (members + rng.normal(0.0, 0.04, size=(identities, dim))).astype(np.float32)
+
+
+def time_search(index, queries, k, batch):
+    """Search in frame-sized batches and return ids plus mean milliseconds per query"""
+    ids = []
+    start = time.perf_counter()
+    for offset in range(0, len(queries), batch):
+        ids.append(index.search(queries[offset:offset + batch], k)[1])
+    elapsed = time.perf_counter() - start
+    return np.concatenate(ids), elapsed * 1000.0 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--identities", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--batch", type=int, default=1, help="Faces matched per call (faces per frame)")
+    parser.add_argument("--lists", type=int, default=None, help="IVF partitions (default sqrt(identities))")
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--samples", type=int, default=1, help="Enrolled encodings per identity")
+    parser.add_argument("--shortlists", type=int, nargs="+", default=[2, 4, 8, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    people = synthetic_gallery(args.identities, 128, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    labels = np.repeat(np.arange(args.identities), args.samples)
+    # Several photos of one person spread a little around their "true" encoding
+    gallery = people[labels]
+    if args.samples > 1:
+        gallery = gallery + rng.normal(0.0, 0.015, size=gallery.shape).astype(np.float32)
+    targets = rng.integers(0, args.identities, args.queries)
+    # Live captures of an enrolled person land close to, but not on, their encoding
+    queries = people[targets] + rng.normal(0.0, 0.02, size=(args.queries, 128)).astype(np.float32)
+
+    exact = FlatIndex(gallery)
+    exact_ids, exact_ms = time_search(exact, queries, args.k, args.batch)
+    results = {"identities": args.identities, "samples": args.samples, "queries": args.queries, "k": args.k,
+               "batch": args.batch,
+               "flat": {"ms_per_query": exact_ms}, "ivf": []}
+
+    start = time.perf_counter()
+    ivf = IVFIndex(gallery, n_lists=args.lists)
+    results["ivf_build_seconds"] = time.perf_counter() - start
+    results["ivf_lists"] = len(ivf.centroids)
+
+    for n_probe in args.probes:
+        ivf.n_probe = n_probe
+        ids, ms = time_search(ivf, queries, args.k, args.batch)
+        recall = np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(exact_ids, ids)])
+        results["ivf"].append({"n_probe": n_probe, "recall": float(recall), "ms_per_query": ms,
+                               "speedup": exact_ms / ms if ms else None})
+
+    if args.samples > 1:
+        identity = IdentityIndex(gallery, labels)
+        # Recall of the identity found, the question recognition actually asks
+        exact_people = labels[exact_ids[:, 0]]
+        results["identity"] = []
+        for shortlist in args.shortlists:
+            identity.shortlist = shortlist
+            ids, ms = time_search(identity, queries, args.k, args.batch)
+            recall = float(np.mean(labels[ids[:, 0]] == exact_people))
+            results["identity"].append({"shortlist": shortlist, "recall": recall, "ms_per_query": ms,
+                                        "speedup": exact_ms / ms if ms else None})
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Encode/parse cost and size of JSON against the binary response protocol.
+
+Uses responses shaped like handle_result's output with 0 to --max-faces faces:
+
+    python bench_protocol.py --iterations 20000
+"""
+import argparse
+import json
+import random
+import time
+
+from protocol import HEADER, BinaryResponseDecoder, BinaryResponseEncoder, JsonResponseEncoder
+
+NAMES = ["Barack Obama", "Shreeya Methuku", "Shibravi Nagesh", "Unknown"]
+
+
+def sample_responses(count, max_faces, seed):
+    rng = random.Random(seed)
+    responses = []
+    for frame_seq in range(1, count + 1):
+        faces = rng.randint(0, max_faces)
+        names = [rng.choice(NAMES) for _ in range(faces)]
+        locations = []
+        for _ in range(faces):
+            top, left = rng.randint(0, 400), rng.randint(0, 600)
+            locations.append({"top": top, "right": left + 120, "bottom": top + 120, "left": left})
+        responses.append({
+            "faces_detected": faces,
+            "recognized": names,
+            "access_granted": any(name != "Unknown" for name in names),
+            "face_locations": locations,
+            "cached": False,
+            "frame_width": 640,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "frame_seq": frame_seq,
+            "queue_depth": rng.randint(0, 4),
+            "processing_ms": rng.randint(5, 200),
+            "detect_width": 320,
+        })
+    return responses
+
+
+def split_messages(data):
+    """Payload views of every framed message in data"""
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        size, = HEADER.unpack_from(view, offset)
+        yield view[offset + HEADER.size:offset + HEADER.size + size]
+        offset += HEADER.size + size
+
+
+def bench(responses, encoder, parse):
+    start = time.perf_counter()
+    encoded = [encoder.encode(response) for response in responses]
+    encode_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for data in encoded:
+        for payload in split_messages(data):
+            parse(payload)
+    parse_seconds = time.perf_counter() - start
+
+    return {
+        "encode_us": encode_seconds * 1e6 / len(responses),
+        "parse_us": parse_seconds * 1e6 / len(responses),
+        "bytes_per_response": sum(len(data) for data in encoded) / len(responses),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--max-faces", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    responses = sample_responses(args.iterations, args.max_faces, args.seed)
+    decoder = BinaryResponseDecoder()
+    results = {
+        "iterations": args.iterations,
+        "json": bench(responses, JsonResponseEncoder(), lambda payload: json.loads(str(payload, "utf-8"))),
+        "binary": bench(responses, BinaryResponseEncoder(), decoder.decode),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
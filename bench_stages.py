@@ -0,0 +1,101 @@
+"""Per-stage micro-benchmark of the server's recognition path.
+
+Runs one image through every stage a frame goes through on the server
+(JPEG decode, resize, face detection, face encoding, gallery matching,
+response encoding and access logging) and reports the cost of each stage
+in milliseconds:
+
+    python bench_stages.py --image faces/obama.jpg --iterations 50 --gallery 10000
+
+The gallery is synthetic (see bench_index.py) so matching can be measured
+at any size without a real face database. Output is JSON so runs can be
+compared against each other.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from access_log import AccessLogger
+from bench_index import synthetic_gallery
+from gallery import FaceGallery
+from protocol import BinaryResponseEncoder
+from recognition import build_result, decode_frame, detect_faces, encode_faces, prepare_frame
+
+JPEG_QUALITY = 70
+
+
+def time_stage(run, iterations):
+    """Call run() iterations times; returns (last result, timing summary in milliseconds)"""
+    timings = []
+    result = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = run()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings = np.asarray(timings)
+    return result, {"mean": float(timings.mean()), "p50": float(np.percentile(timings, 50)),
+                    "p99": float(np.percentile(timings, 99)), "max": float(timings.max())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", default=os.path.join("faces", "obama.jpg"), help="Image to push through the stages")
+    parser.add_argument("--width", type=int, default=640, help="Width the image is sent at, as a camera would")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--gallery", type=int, default=1000, help="Synthetic encodings to match against")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image)
+    if image is None:
+        parser.error(f"Could not read {args.image}")
+    height = max(1, int(round(image.shape[0] * args.width / image.shape[1])))
+    image = cv2.resize(image, (args.width, height), interpolation=cv2.INTER_AREA)
+    jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])[1].tobytes()
+
+    encodings = synthetic_gallery(args.gallery, 128, args.seed)
+    gallery = FaceGallery(encodings, [f"person_{i}" for i in range(args.gallery)])
+
+    stages = {}
+    frame, stages["decode"] = time_stage(lambda: decode_frame(jpeg), args.iterations)
+    (rgb_small_frame, scale), stages["resize"] = time_stage(lambda: prepare_frame(frame), args.iterations)
+    locations, stages["detect"] = time_stage(lambda: detect_faces(rgb_small_frame), args.iterations)
+    face_encodings, stages["encode"] = time_stage(lambda: encode_faces(rgb_small_frame, locations),
+                                                  args.iterations)
+    # Without a face in the image there is nothing to match, use a gallery row instead
+    queries = np.asarray(face_encodings, dtype=np.float32) if len(face_encodings) else encodings[:1]
+    names, stages["match"] = time_stage(lambda: gallery.identify(queries), args.iterations)
+    result = build_result(locations, names[:len(locations)], scale, frame.shape[1])
+    encoder = BinaryResponseEncoder()
+    _, stages["respond"] = time_stage(lambda: encoder.encode(result), args.iterations)
+
+    with tempfile.TemporaryDirectory() as directory:
+        logger = AccessLogger(os.path.join(directory, "access_log.txt"))
+        try:
+            # What a connection thread pays; the writer thread does the disk I/O
+            _, stages["log"] = time_stage(lambda: logger.log(result["access_granted"], names, "bench"),
+                                          args.iterations)
+        finally:
+            logger.close()
+
+    results = {
+        "image": args.image,
+        "frame_width": frame.shape[1],
+        "detect_width": rgb_small_frame.shape[1],
+        "jpeg_bytes": len(jpeg),
+        "faces": len(locations),
+        "gallery": args.gallery,
+        "iterations": args.iterations,
+        "stages_ms": stages,
+        "total_mean_ms": sum(stage["mean"] for stage in stages.values()),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
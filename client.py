@@ -58,18 +58,54 @@ import json
 import ssl
 import numpy as np
 import os
+import argparse
+
+from protocol import (FrameReader, BinaryResponseDecoder, LATEST_PROTOCOL, PROTOCOL_BINARY, PROTOCOL_CROPS,
+                      PROTOCOL_JSON, pack_crops, pack_hello, parse_hello)
+from local_detection import BackgroundFaceDetector, LocalFaceDetector
+from pipeline import LatestFrameSlot
+from rate_control import AdaptiveRateController
 
 SERVER_IP = '127.0.0.1'  # Change to server IP if remote
 PORT = 9999
 RECONNECT_DELAY = 5  # Seconds to wait before reconnecting
+HANDSHAKE_TIMEOUT = 2  # Seconds to wait for the server to answer the protocol handshake
+CROP_PADDING = 0.3  # Margin added around each face crop, as a fraction of the face size
+MAX_CROP_SIZE = 200  # Longest side of an uploaded face crop in pixels
+SEND_POLL_INTERVAL = 0.005  # Seconds the send stage sleeps while the rate controller holds it back
+STAGE_REPORT_INTERVAL = 5  # Seconds between client stage FPS/latency reports
 
 # Get user's home directory
 HOME_DIR = os.path.expanduser('~')
 # Define cascade file path in the user's home directory
 CASCADE_PATH = os.path.join(HOME_DIR, 'haarcascade_frontalface_default.xml')
 
+class StageMeter:
+    """Frame rate and mean latency of one client stage since its last report"""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.total_latency = 0.0
+        self.since = time.monotonic()
+
+    def record(self, started):
+        """Count one frame whose latency is measured from started (time.monotonic())"""
+        with self.lock:
+            self.frames += 1
+            self.total_latency += time.monotonic() - started
+
+    def report(self):
+        with self.lock:
+            now = time.monotonic()
+            fps = self.frames / max(now - self.since, 1e-6)
+            latency_ms = self.total_latency / self.frames * 1000 if self.frames else 0.0
+            self.frames, self.total_latency, self.since = 0, 0.0, now
+        return f"{self.name} {fps:.1f} fps / {latency_ms:.0f} ms"
+
 class FaceRecognitionClient:
-    def __init__(self, server_ip, port, cascade_path=CASCADE_PATH):
+    def __init__(self, server_ip, port, cascade_path=CASCADE_PATH, crop_upload=False):
         self.server_ip = server_ip
         self.port = port
         self.connected = False
@@ -80,6 +116,23 @@ class FaceRecognitionClient:
         self.face_locations = []
         self.last_response_time = time.time()
         self.cascade_path = cascade_path
+        # Haar cascade detector, loaded on first use and kept for every later frame
+        self.detector = None
+        self.detector_failed = False
+        self.protocol = PROTOCOL_JSON
+        # Detect faces locally and upload only face crops (needs a server speaking PROTOCOL_CROPS)
+        self.crop_upload = crop_upload
+        # Width of the sent frame the server's face locations refer to
+        self.location_frame_width = 0
+        self.rate = AdaptiveRateController()
+        # Newest (captured_at, frame) from the capture stage, picked up by the render stage
+        self.frame_condition = threading.Condition()
+        self.latest_frame = None
+        self.captured_frames = 0
+        # Capture latency is the wait for the camera, send and render latency count from capture
+        self.capture_meter = StageMeter("capture")
+        self.send_meter = StageMeter("send")
+        self.render_meter = StageMeter("render")
 
     def connect_to_server(self):
         while self.running:
@@ -94,6 +147,9 @@ class FaceRecognitionClient:
                 
                 self.client_socket.connect((self.server_ip, self.port))
                 print("✅ Connected to server")
+                self.negotiate_protocol()
+                # Frame numbering and pacing start over with every connection
+                self.rate = AdaptiveRateController()
                 self.connected = True
                 
                 # Start response receiver thread
@@ -118,162 +174,281 @@ class FaceRecognitionClient:
                     print(f"♻️ Reconnecting in {RECONNECT_DELAY} seconds...")
                     time.sleep(RECONNECT_DELAY)
 
+    def negotiate_protocol(self):
+        """Ask for the compact binary response format, falling back to JSON on older servers"""
+        self.client_socket.sendall(pack_hello(LATEST_PROTOCOL))
+        self.client_socket.settimeout(HANDSHAKE_TIMEOUT)
+        try:
+            reply = FrameReader(self.client_socket).read_message()
+            version = parse_hello(reply) if reply is not None else None
+        except socket.timeout:
+            version = None
+        finally:
+            self.client_socket.settimeout(None)
+        self.protocol = version or PROTOCOL_JSON
+        print(f"🤝 Using {'binary' if self.protocol >= PROTOCOL_BINARY else 'JSON'} responses")
+        if self.crop_upload and self.protocol < PROTOCOL_CROPS:
+            print("⚠️ Server does not accept face crops, uploading full frames")
+
     def receive_responses(self):
-        data_buffer = b""
+        reader = FrameReader(self.client_socket)
+        decoder = BinaryResponseDecoder() if self.protocol >= PROTOCOL_BINARY else None
         while self.connected:
             try:
-                # Read response size (4 bytes)
-                while len(data_buffer) < 4:
-                    packet = self.client_socket.recv(4096)
-                    if not packet:
-                        print("❌ Server disconnected")
-                        self.connected = False
-                        return
-                    data_buffer += packet
-                
-                # Extract response size and remove from buffer
-                response_size = struct.unpack(">L", data_buffer[:4])[0]
-                data_buffer = data_buffer[4:]
-                
-                # Read complete response
-                while len(data_buffer) < response_size:
-                    data_buffer += self.client_socket.recv(4096)
-                
-                # Extract response data and update buffer
-                response_data = data_buffer[:response_size]
-                data_buffer = data_buffer[response_size:]
+                # Read the next length-prefixed response into the reusable buffer
+                response_data = reader.read_message()
+                if response_data is None:
+                    print("❌ Server disconnected")
+                    self.connected = False
+                    return
                 
                 # Parse response
-                response = json.loads(response_data.decode())
+                if decoder is not None:
+                    response = decoder.decode(response_data)
+                    if response is None:
+                        # Name table update, the matching result follows
+                        continue
+                else:
+                    response = json.loads(str(response_data, "utf-8"))
                 self.recognized_names = response.get("recognized", [])
                 self.access_status = "Access Granted" if response.get("access_granted", False) else "Access Denied"
                 self.face_locations = response.get("face_locations", [])
+                self.location_frame_width = response.get("frame_width", 0)
                 self.last_response_time = time.time()
+                self.rate.on_response(response)
                 print(f"👤 Recognized: {self.recognized_names} - {self.access_status}")
             except Exception as e:
                 print(f"💥 Error receiving response: {e}")
                 self.connected = False
                 break
 
+    def load_local_detector(self):
+        """Load the Haar cascade once; None (reported once) if it is unavailable"""
+        if self.detector is None and not self.detector_failed:
+            try:
+                self.detector = LocalFaceDetector(self.cascade_path)
+            except (FileNotFoundError, ValueError) as e:
+                print(f"❌ Error: {e}")
+                self.detector_failed = True
+        return self.detector
+
     def detect_faces_locally(self, frame):
         """Detect faces locally as a fallback if server doesn't provide locations"""
+        detector = self.load_local_detector()
+        if detector is None:
+            return []
         try:
-            # Check if cascade file exists
-            if not os.path.isfile(self.cascade_path):
-                print(f"❌ Error: Haar cascade file not found at {self.cascade_path}")
-                return []
-                
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            # Use the specific path to the Haar cascade file
-            face_cascade = cv2.CascadeClassifier(self.cascade_path)
-            
-            # Check if classifier loaded successfully
-            if face_cascade.empty():
-                print("❌ Error: Haar cascade file could not be loaded. Check the file path.")
-                return []
-                
-            faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-            
-            # Convert to the same format as server face locations
-            face_locations = []
-            for (x, y, w, h) in faces:
-                face_locations.append({
-                    "top": y,
-                    "right": x + w,
-                    "bottom": y + h,
-                    "left": x
-                })
-            return face_locations
+            return detector.detect(frame)
         except Exception as e:
             print(f"❌ Error detecting faces locally: {e}")
             return []
 
+    def pack_face_crops(self, frame, face_locations, quality):
+        """Framed crop upload of locally detected faces in a full frame"""
+        frame_height, frame_width = frame.shape[:2]
+        crops = []
+        for face_loc in face_locations:
+            top, right, bottom, left = (int(face_loc[key]) for key in ("top", "right", "bottom", "left"))
+            pad_x = int((right - left) * CROP_PADDING)
+            pad_y = int((bottom - top) * CROP_PADDING)
+            x, y = max(0, left - pad_x), max(0, top - pad_y)
+            x2, y2 = min(frame_width, right + pad_x), min(frame_height, bottom + pad_y)
+            crop = frame[y:y2, x:x2]
+            # The server rescales the face box, so large faces can be sent smaller
+            factor = min(1.0, MAX_CROP_SIZE / float(max(crop.shape[:2])))
+            if factor < 1.0:
+                crop = cv2.resize(crop, (0, 0), fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+            _, buffer = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            crops.append(((top, right, bottom, left), (x, y, x2 - x, y2 - y), buffer.tobytes()))
+        # Frames without faces still go out (empty) so the server can answer them
+        return pack_crops(frame_width, frame_height, crops)
+
+    def capture_frames(self, cap, send_slot, local_detection, crop_mode):
+        """Capture stage: read the camera as fast as it delivers frames"""
+        while self.connected and self.running:
+            started = time.monotonic()
+            ret, frame = cap.read()
+            if not ret:
+                continue
+            captured_at = time.monotonic()
+            self.capture_meter.record(started)
+            with self.frame_condition:
+                self.latest_frame = (captured_at, frame)
+                self.captured_frames += 1
+                self.frame_condition.notify_all()
+            if crop_mode:
+                local_detection.submit(frame, captured_at)
+            else:
+                # Latest frame wins: the send stage never works on a stale frame
+                send_slot.put((captured_at, frame))
+
+    def send_loop(self, send_slot, local_detection, crop_mode):
+        """Encode/send stage: upload the newest frame whenever the rate controller allows"""
+        last_crop_seq = 0
+        while self.connected and self.running:
+            if not self.rate.ready():
+                time.sleep(SEND_POLL_INTERVAL)
+                continue
+            if crop_mode:
+                # Only the padded face crops travel, the server skips detection.
+                # Crops are cut from the frame the detection ran on, once per detection.
+                crop_seq, frame, faces, captured_at = local_detection.latest()
+                if crop_seq == last_crop_seq:
+                    time.sleep(SEND_POLL_INTERVAL)
+                    continue
+                last_crop_seq = crop_seq
+                message = self.pack_face_crops(frame, faces, self.rate.quality)
+            else:
+                item = send_slot.get()
+                if item is None:
+                    break
+                captured_at, frame = item
+                # Resize to the width the server detects at & compress at the current quality
+                width, height = self.rate.frame_size(frame.shape[1], frame.shape[0])
+                small_frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+                _, buffer = cv2.imencode('.jpg', small_frame, [cv2.IMWRITE_JPEG_QUALITY, self.rate.quality])
+                data = buffer.tobytes()
+                # Length prefix
+                message = struct.pack('>L', len(data)) + data
+            
+            try:
+                self.client_socket.sendall(message)
+            except Exception as e:
+                print(f"💥 Error sending frame: {e}")
+                self.connected = False
+                break
+            self.rate.on_sent()
+            self.send_meter.record(captured_at)
+
+    def render_frames(self, local_detection, crop_mode):
+        """Render stage: draw the latest results over the newest frame and show it"""
+        shown_frames = 0
+        next_report = time.monotonic() + STAGE_REPORT_INTERVAL
+        while self.connected and self.running:
+            with self.frame_condition:
+                if self.captured_frames == shown_frames:
+                    self.frame_condition.wait(timeout=0.5)
+                if self.captured_frames == shown_frames:
+                    continue
+                shown_frames = self.captured_frames
+                captured_at, frame = self.latest_frame
+            
+            # Create a copy for display
+            display_frame = frame.copy()
+            
+            # Use server face locations or detect locally as fallback
+            face_locations = self.face_locations
+            # Server locations refer to the downscaled frame that was sent
+            scale = frame.shape[1] / self.location_frame_width if self.location_frame_width else 1.0
+            if not face_locations and time.time() - self.last_response_time > 1.0 and local_detection is not None:
+                if not crop_mode:
+                    local_detection.submit(frame, captured_at)
+                # Newest boxes the detection thread has, possibly from a slightly older frame
+                face_locations = local_detection.faces
+                scale = 1.0
+            
+            # Draw face boxes and names
+            for i, face_loc in enumerate(face_locations):
+                # Extract coordinates
+                top = int(face_loc["top"] * scale)
+                right = int(face_loc["right"] * scale)
+                bottom = int(face_loc["bottom"] * scale)
+                left = int(face_loc["left"] * scale)
+                
+                # Determine the name and access status
+                name = "Unknown"
+                if i < len(self.recognized_names):
+                    name = self.recognized_names[i]
+                
+                # Set colors based on recognition
+                if name != "Unknown" and self.access_status == "Access Granted":
+                    color = (0, 255, 0)  # Green for recognized & granted
+                else:
+                    color = (0, 0, 255)  # Red for unrecognized or denied
+                
+                # Draw rectangle around the face
+                cv2.rectangle(display_frame, (left, top), (right, bottom), color, 2)
+                
+                # Draw filled rectangle for text background
+                cv2.rectangle(display_frame, (left, bottom), (right, bottom+30), color, cv2.FILLED)
+                
+                # Put name text
+                cv2.putText(display_frame, name, (left+5, bottom+25),
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+            
+            # Display access status
+            status_color = (0, 255, 0) if self.access_status == "Access Granted" else (0, 0, 255)
+            
+            # Draw status bar at the top
+            cv2.rectangle(display_frame, (0, 0), (frame.shape[1], 40), (0, 0, 0), cv2.FILLED)
+            cv2.putText(display_frame, self.access_status, (10, 30),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1, status_color, 2)
+            
+            # Display the frame with overlays
+            cv2.imshow('Face Recognition System', display_frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                self.running = False
+                break
+            self.render_meter.record(captured_at)
+            
+            if time.monotonic() >= next_report:
+                next_report = time.monotonic() + STAGE_REPORT_INTERVAL
+                print("📊 " + ", ".join(meter.report() for meter in
+                                       (self.capture_meter, self.send_meter, self.render_meter)))
+
     def send_frames(self):
         cap = cv2.VideoCapture(0)
         if not cap.isOpened():
             print("❌ Cannot access webcam")
             return
         
+        # Local detection runs on its own thread so the preview never waits for the cascade
+        detector = self.load_local_detector()
+        local_detection = BackgroundFaceDetector(detector) if detector is not None else None
+        crop_mode = self.crop_upload and self.protocol >= PROTOCOL_CROPS and local_detection is not None
+        
+        # Capture and encode/send run on their own threads, rendering stays on this one
+        # (GUI calls must come from the main thread on some platforms)
+        send_slot = LatestFrameSlot()
+        stages = [
+            threading.Thread(target=self.capture_frames, args=(cap, send_slot, local_detection, crop_mode),
+                             name="capture"),
+            threading.Thread(target=self.send_loop, args=(send_slot, local_detection, crop_mode), name="send"),
+        ]
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
         try:
-            while self.connected and self.running:
-                ret, frame = cap.read()
-                if not ret:
-                    continue
-                
-                # Create a copy for display
-                display_frame = frame.copy()
-                
-                # Use server face locations or detect locally as fallback
-                face_locations = self.face_locations
-                if not face_locations and time.time() - self.last_response_time > 1.0:
-                    face_locations = self.detect_faces_locally(frame)
-                
-                # Draw face boxes and names
-                for i, face_loc in enumerate(face_locations):
-                    # Extract coordinates
-                    top = face_loc["top"]
-                    right = face_loc["right"]
-                    bottom = face_loc["bottom"]
-                    left = face_loc["left"]
-                    
-                    # Determine the name and access status
-                    name = "Unknown"
-                    if i < len(self.recognized_names):
-                        name = self.recognized_names[i]
-                    
-                    # Set colors based on recognition
-                    if name != "Unknown" and self.access_status == "Access Granted":
-                        color = (0, 255, 0)  # Green for recognized & granted
-                    else:
-                        color = (0, 0, 255)  # Red for unrecognized or denied
-                    
-                    # Draw rectangle around the face
-                    cv2.rectangle(display_frame, (left, top), (right, bottom), color, 2)
-                    
-                    # Draw filled rectangle for text background
-                    cv2.rectangle(display_frame, (left, bottom), (right, bottom+30), color, cv2.FILLED)
-                    
-                    # Put name text
-                    cv2.putText(display_frame, name, (left+5, bottom+25),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
-                
-                # Display access status
-                status_color = (0, 255, 0) if self.access_status == "Access Granted" else (0, 0, 255)
-                
-                # Draw status bar at the top
-                cv2.rectangle(display_frame, (0, 0), (frame.shape[1], 40), (0, 0, 0), cv2.FILLED)
-                cv2.putText(display_frame, self.access_status, (10, 30),
-                           cv2.FONT_HERSHEY_SIMPLEX, 1, status_color, 2)
-                
-                # Resize & compress frame for sending
-                small_frame = cv2.resize(frame, (0, 0), fx=0.3, fy=0.3)
-                _, buffer = cv2.imencode('.jpg', small_frame, [cv2.IMWRITE_JPEG_QUALITY, 50])
-                data = buffer.tobytes()
-                
-                # Send with length prefix
-                try:
-                    self.client_socket.sendall(struct.pack('>L', len(data)) + data)
-                except Exception as e:
-                    print(f"💥 Error sending frame: {e}")
-                    break
-                
-                # Display the frame with overlays
-                cv2.imshow('Face Recognition System', display_frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
-                
-                time.sleep(0.1)  # 10 FPS max
+            self.render_frames(local_detection, crop_mode)
         finally:
+            self.running = False
+            send_slot.close()
+            for stage in stages:
+                stage.join()
+            if local_detection is not None:
+                local_detection.stop()
+            print(f"📈 Rate control: {json.dumps(self.rate.stats())}")
             cap.release()
             cv2.destroyAllWindows()
-            self.running = False
 
     def stop(self):
         self.running = False
         if self.client_socket:
             self.client_socket.close()
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Facial recognition security client")
+    parser.add_argument("--crops", action="store_true",
+                        help="Detect faces locally and upload only padded face crops instead of whole frames")
+    parser.add_argument("--server", default=f"{SERVER_IP}:{PORT}",
+                        help="Recognition server or balancer as HOST[:PORT]")
+    args = parser.parse_args()
+    host, _, port = args.server.partition(":")
+    args.server_ip, args.port = host or SERVER_IP, int(port or PORT)
+    return args
+
 if __name__ == "__main__":
+    args = parse_args()
     # Check if cascade file exists, if not, download it
     if not os.path.isfile(CASCADE_PATH):
         print(f"Haar cascade file not found. Downloading to {CASCADE_PATH}...")
@@ -286,7 +461,7 @@ if __name__ == "__main__":
             print(f"❌ Failed to download: {e}")
             exit(1)
     
-    client = FaceRecognitionClient(SERVER_IP, PORT)
+    client = FaceRecognitionClient(args.server_ip, args.port, crop_upload=args.crops)
     try:
         client.connect_to_server()
     except KeyboardInterrupt:
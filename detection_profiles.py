@@ -0,0 +1,51 @@
+import json
+
+from recognition import DEFAULT_PROFILE, DetectionProfile
+
+PROFILES_FILE = "detection_profiles.json"
+
+
+class DetectionProfiles:
+    """Maps cameras to DetectionProfiles, read from a JSON file like:
+
+        {
+          "profiles": {
+            "default": {"detect_width": 320},
+            "door": {"detect_width": 480, "upsample": 2, "roi": [0.3, 0.0, 0.4, 1.0]},
+            "lobby": {"detect_width": 240, "upsample": 0, "refine": true}
+          },
+          "cameras": {"192.168.1.20": "door", "192.168.1.21": "lobby"}
+        }
+
+    Cameras are matched by IP address. Cameras that are not listed use the
+    "default" profile, which is the built-in one unless the file overrides it.
+    """
+
+    def __init__(self, profiles=None, cameras=None):
+        self.profiles = {"default": DEFAULT_PROFILE}
+        self.profiles.update(profiles or {})
+        self.cameras = dict(cameras or {})
+        for camera, name in self.cameras.items():
+            if name not in self.profiles:
+                raise ValueError(f"Camera {camera} uses unknown detection profile {name!r}")
+
+    @classmethod
+    def load(cls, path=PROFILES_FILE):
+        with open(path) as f:
+            config = json.load(f)
+        profiles = {}
+        for name, options in config.get("profiles", {}).items():
+            try:
+                profiles[name] = DetectionProfile(name, **options)
+            except TypeError as e:
+                raise ValueError(f"Detection profile {name!r}: {e}") from None
+        return cls(profiles, config.get("cameras"))
+
+    def for_camera(self, addr):
+        """Profile of the camera connecting from addr, an (ip, port) pair or a bare IP"""
+        host = addr[0] if isinstance(addr, tuple) else addr
+        return self.profiles[self.cameras.get(host, "default")]
+
+    def stats(self):
+        """Cost of each profile that has processed frames in this process"""
+        return {name: profile.stats() for name, profile in self.profiles.items() if profile.frames}
@@ -0,0 +1,196 @@
+"""Compile a directory of face images into the server's face database.
+
+Images directly in the directory are enrolled under their file name
+(barack_obama.jpg -> "Barack Obama"); images in a subdirectory are enrolled
+under the subdirectory's name, so one person can have several photos:
+
+    python enroll.py faces/ --jobs 4
+
+The output is columnar: face_database.npy holds one float32 encoding per
+row and face_database.names.json holds the identity of every row plus a
+manifest of content hashes. Re-running only encodes images that are new or
+changed; removed images are dropped. The server memory-maps the matrix.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from face_index import ENCODING_SIZE
+
+ENCODINGS_FILE = "face_database.npy"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def names_path_for(encodings_file):
+    """face_database.npy -> face_database.names.json"""
+    return os.path.splitext(encodings_file)[0] + ".names.json"
+
+
+def identity_for(relative_path):
+    """Enrollment name of an image: its subdirectory, or its file name for top-level images"""
+    directory, filename = os.path.split(relative_path)
+    if directory:
+        return directory.split(os.sep)[0]
+    return os.path.splitext(filename)[0].replace("_", " ").title()
+
+
+def content_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def find_images(directory):
+    """Relative paths of every image below directory, sorted"""
+    images = []
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(os.path.relpath(os.path.join(root, filename), directory))
+    return sorted(images)
+
+
+def encode_image(path):
+    """(path, encoding of the largest face or None, error message or None)"""
+    # Imported here so reading a compiled database never needs dlib
+    import face_recognition
+    try:
+        image = face_recognition.load_image_file(path)
+        locations = face_recognition.face_locations(image)
+        if not locations:
+            return path, None, "no face found"
+        # Enrollment photos may catch someone in the background, keep the main face
+        largest = max(locations, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))
+        encoding = face_recognition.face_encodings(image, [largest])[0]
+        return path, np.asarray(encoding, dtype=np.float32), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def save_atomic(path, write):
+    """Write through a temporary file and rename it into place"""
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        write(f)
+    os.replace(temporary, path)
+
+
+def write_database(encodings_file, matrix, identities, ids, files):
+    # The matrix goes first; load_compiled_database rejects a sidecar whose row count differs
+    save_atomic(encodings_file, lambda f: np.save(f, matrix))
+    sidecar = {"rows": len(ids), "identities": identities, "ids": ids, "files": files}
+    save_atomic(names_path_for(encodings_file), lambda f: f.write(json.dumps(sidecar, indent=1).encode()))
+
+
+def read_sidecar(encodings_file):
+    with open(names_path_for(encodings_file)) as f:
+        return json.load(f)
+
+
+def load_compiled_database(encodings_file=ENCODINGS_FILE):
+    """(encodings, names) with the encodings memory-mapped read-only.
+
+    Every process that loads the same file shares one page-cached copy.
+    """
+    sidecar = read_sidecar(encodings_file)
+    # An empty matrix cannot be mapped
+    encodings = np.load(encodings_file, mmap_mode="r" if sidecar["rows"] else None)
+    if encodings.shape != (sidecar["rows"], ENCODING_SIZE):
+        raise ValueError(f"{encodings_file} has shape {encodings.shape}, "
+                         f"its sidecar expects {sidecar['rows']} rows")
+    identities = sidecar["identities"]
+    return encodings, [identities[i] for i in sidecar["ids"]]
+
+
+def compile_database(directory, encodings_file=ENCODINGS_FILE, jobs=None, full=False):
+    """Encode new and changed images of directory into encodings_file; returns counts"""
+    old_files, old_matrix = {}, None
+    if not full and os.path.exists(encodings_file) and os.path.exists(names_path_for(encodings_file)):
+        sidecar = read_sidecar(encodings_file)
+        old_files = sidecar["files"]
+        old_matrix = np.load(encodings_file, mmap_mode="r" if sidecar["rows"] else None)
+
+    images = find_images(directory)
+    hashes = {image: content_hash(os.path.join(directory, image)) for image in images}
+    # Copied out of the mapping so nothing keeps the old file mapped once old_matrix is dropped
+    reused = {image: np.array(old_matrix[old_files[image]["row"]]) for image in images
+              if image in old_files and old_files[image]["sha1"] == hashes[image]
+              and old_files[image]["row"] is not None}
+    unchanged_without_face = {image for image in images
+                              if image in old_files and old_files[image]["sha1"] == hashes[image]
+                              and old_files[image]["row"] is None}
+    to_encode = [image for image in images if image not in reused and image not in unchanged_without_face]
+
+    encoded, failed = {}, []
+    if to_encode:
+        paths = [os.path.join(directory, image) for image in to_encode]
+        jobs = min(jobs or os.cpu_count() or 1, len(paths))
+        if jobs > 1:
+            with multiprocessing.get_context().Pool(jobs) as pool:
+                results = pool.map(encode_image, paths)
+        else:
+            results = [encode_image(path) for path in paths]
+        for image, (path, encoding, error) in zip(to_encode, results):
+            if encoding is None:
+                print(f"⚠️ {path}: {error}")
+                failed.append(image)
+            else:
+                encoded[image] = encoding
+
+    rows, ids, files = [], [], {}
+    identities = sorted({identity_for(image) for image in images})
+    identity_ids = {name: i for i, name in enumerate(identities)}
+    for image in images:
+        encoding = reused.get(image)
+        if encoding is None:
+            encoding = encoded.get(image)
+        row = None
+        if encoding is not None:
+            row = len(rows)
+            rows.append(np.asarray(encoding, dtype=np.float32))
+            ids.append(identity_ids[identity_for(image)])
+        files[image] = {"sha1": hashes[image], "name": identity_for(image), "row": row}
+
+    # Identities whose every photo failed are not listed
+    used = sorted(set(ids))
+    remap = {old: new for new, old in enumerate(used)}
+    identities = [identities[i] for i in used]
+    ids = [remap[i] for i in ids]
+
+    matrix = np.vstack(rows) if rows else np.empty((0, ENCODING_SIZE), dtype=np.float32)
+    # Release the old mapping before its file is replaced (Windows cannot replace a mapped file)
+    del old_matrix
+    write_database(encodings_file, matrix, identities, ids, files)
+    return {
+        "images": len(images),
+        "unchanged": len(images) - len(to_encode),
+        "encoded": len(encoded),
+        "failed": len(failed),
+        "removed": len(set(old_files) - set(images)),
+        "identities": len(identities),
+        "rows": len(ids),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directory of face images to enroll")
+    parser.add_argument("--output", default=ENCODINGS_FILE, help="Encoding matrix to write (.npy)")
+    parser.add_argument("--jobs", type=int, default=None, help="Encoder processes (default: one per CPU core)")
+    parser.add_argument("--full", action="store_true", help="Re-encode every image, ignoring the manifest")
+    args = parser.parse_args()
+
+    counts = compile_database(args.directory, args.output, args.jobs, args.full)
+    print(f"✅ {counts['images']} images: {counts['unchanged']} unchanged, {counts['encoded']} encoded, "
+          f"{counts['failed']} without a usable face, {counts['removed']} removed")
+    print(f"💾 Wrote {counts['rows']} encodings of {counts['identities']} people to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
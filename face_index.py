@@ -0,0 +1,365 @@
+import copy
+import hashlib
+import os
+
+import numpy as np
+
+ENCODING_SIZE = 128
+INDEX_SUFFIX = ".index.npz"
+# Chunk size used when assigning large galleries to k-means centroids
+ASSIGN_CHUNK = 8192
+# Identities whose member encodings are scanned per query at most (identity index)
+SHORTLIST = 8
+
+
+def squared_distances(queries, matrix, norms):
+    """Squared Euclidean distance from every query row to every matrix row"""
+    query_norms = np.einsum("ij,ij->i", queries, queries)
+    squared = queries @ matrix.T
+    squared *= -2.0
+    squared += query_norms[:, None]
+    squared += norms[None, :]
+    np.maximum(squared, 0.0, out=squared)
+    return squared
+
+
+def top_k(distances, k):
+    """Column indices and values of the k smallest entries of each row, sorted"""
+    k = min(k, distances.shape[1])
+    if k < distances.shape[1]:
+        columns = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        columns = np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+    values = np.take_along_axis(distances, columns, axis=1)
+    order = np.argsort(values, axis=1)
+    return np.take_along_axis(values, order, axis=1), np.take_along_axis(columns, order, axis=1)
+
+
+def fingerprint(encodings):
+    """Content hash identifying the gallery an index was built from"""
+    matrix = np.ascontiguousarray(encodings, dtype=np.float32)
+    return hashlib.sha1(matrix.tobytes()).hexdigest()
+
+
+class FlatIndex:
+    """Exact brute-force search over every enrolled encoding"""
+
+    kind = "flat"
+
+    def __init__(self, encodings):
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32)
+        self.norms = np.einsum("ij,ij->i", self.encodings, self.encodings)
+
+    def __len__(self):
+        return len(self.encodings)
+
+    def search(self, queries, k=1):
+        """Distances and ids of the k nearest encodings for each query, closest first"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.encodings.shape[1])
+        if len(queries) == 0 or len(self.encodings) == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+        squared, ids = top_k(squared_distances(queries, self.encodings, self.norms), k)
+        return np.sqrt(squared), ids
+
+    def appended(self, encodings, labels=None):
+        """Index over encodings whose first len(self) rows are this index's; only new rows are processed"""
+        index = copy.copy(self)
+        index.encodings = encodings
+        new = encodings[len(self.encodings):]
+        index.norms = np.concatenate((self.norms, np.einsum("ij,ij->i", new, new)))
+        return index
+
+    def masked(self, ids):
+        return _masked(self, ids)
+
+    def state(self):
+        return {}
+
+    @classmethod
+    def from_state(cls, encodings, state):
+        return cls(encodings)
+
+
+class IVFIndex:
+    """Approximate search over k-means partitions of the gallery (inverted file).
+
+    Each query is compared against the centroids first, and only the encodings
+    in the n_probe closest partitions are scanned exactly.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, encodings, n_lists=None, n_probe=8, iterations=20, seed=0, _trained=None):
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32)
+        self.norms = np.einsum("ij,ij->i", self.encodings, self.encodings)
+        self.n_probe = n_probe
+
+        if _trained is not None:
+            self.centroids, self.order, self.offsets = _trained
+        else:
+            if n_lists is None:
+                n_lists = max(1, int(np.sqrt(len(self.encodings))))
+            n_lists = max(1, min(n_lists, len(self.encodings)))
+            self.centroids = self._train(n_lists, iterations, seed)
+            assignments = self._assign(self.encodings)
+            # Store the members of every list contiguously: order[offsets[i]:offsets[i + 1]]
+            self.order = np.argsort(assignments, kind="stable").astype(np.int64)
+            counts = np.bincount(assignments, minlength=len(self.centroids))
+            self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+        self.centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+
+    def __len__(self):
+        return len(self.encodings)
+
+    def _assign(self, vectors, centroids=None):
+        if centroids is None:
+            centroids = self.centroids
+        centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), ASSIGN_CHUNK):
+            chunk = vectors[start:start + ASSIGN_CHUNK]
+            assignments[start:start + ASSIGN_CHUNK] = np.argmin(
+                squared_distances(chunk, centroids, centroid_norms), axis=1)
+        return assignments
+
+    def _train(self, n_lists, iterations, seed):
+        if len(self.encodings) == 0:
+            return np.empty((0, self.encodings.shape[1]), dtype=np.float32)
+
+        rng = np.random.default_rng(seed)
+        # Lloyd's k-means on a bounded sample keeps training time flat for huge galleries
+        sample_size = min(len(self.encodings), n_lists * 256)
+        sample = self.encodings[rng.choice(len(self.encodings), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = self._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=n_lists)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            # Re-seed empty partitions with random samples
+            if not filled.all():
+                centroids[~filled] = sample[rng.choice(sample_size, (~filled).sum())]
+        return centroids
+
+    def search(self, queries, k=1):
+        """Approximate distances and ids of the k nearest encodings, closest first"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.encodings.shape[1])
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if len(queries) == 0 or len(self.encodings) == 0:
+            return distances[:, :0], ids[:, :0]
+
+        n_probe = min(self.n_probe, len(self.centroids))
+        _, probes = top_k(squared_distances(queries, self.centroids, self.centroid_norms), n_probe)
+
+        for row, (query, lists) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+            if len(candidates) == 0:
+                continue
+            squared = squared_distances(query[None, :], self.encodings[candidates], self.norms[candidates])
+            best, columns = top_k(squared, k)
+            found = best.shape[1]
+            distances[row, :found] = np.sqrt(best[0])
+            ids[row, :found] = candidates[columns[0]]
+
+        # Drop result columns that no query could fill
+        filled = min(k, len(self.encodings))
+        return distances[:, :filled], ids[:, :filled]
+
+    def appended(self, encodings, labels=None):
+        """Index over encodings whose first len(self) rows are this index's.
+
+        New rows join the list of their nearest centroid; nothing is retrained.
+        """
+        index = copy.copy(self)
+        index.encodings = encodings
+        new = encodings[len(self.encodings):]
+        index.norms = np.concatenate((self.norms, np.einsum("ij,ij->i", new, new)))
+        assignments = self._assign(new)
+        new_ids = np.arange(len(self.encodings), len(encodings), dtype=np.int64)
+        by_list = np.argsort(assignments, kind="stable")
+        # Insert every new id at the end of its list, lists stay contiguous
+        index.order = np.insert(self.order, self.offsets[assignments[by_list] + 1], new_ids[by_list])
+        counts = np.bincount(assignments, minlength=len(self.centroids))
+        index.offsets = self.offsets + np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return index
+
+    def masked(self, ids):
+        return _masked(self, ids)
+
+    def state(self):
+        return {"centroids": self.centroids, "order": self.order, "offsets": self.offsets,
+                "n_probe": np.int64(self.n_probe)}
+
+    @classmethod
+    def from_state(cls, encodings, state):
+        trained = (state["centroids"], state["order"], state["offsets"])
+        return cls(encodings, n_probe=int(state["n_probe"]), _trained=trained)
+
+
+class IdentityIndex:
+    """Search that shortlists identities before scanning their encodings.
+
+    Rows are grouped by label (the enrolled name). Each identity keeps the
+    centroid of its encodings and its radius, the largest member distance
+    from that centroid. By the triangle inequality every member of identity
+    i lies between d(q, c_i) - r_i and d(q, c_i) + r_i from a query, so only
+    identities whose lower bound does not exceed the k-th smallest upper
+    bound can hold a nearest encoding. At most `shortlist` of those, closest
+    lower bound first, are scanned exactly. Cost grows with the number of
+    identities, not with the number of samples enrolled per identity.
+    """
+
+    kind = "identity"
+    needs_labels = True
+
+    def __init__(self, encodings, labels, shortlist=SHORTLIST, norms=None):
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32)
+        if norms is None:
+            norms = np.einsum("ij,ij->i", self.encodings, self.encodings)
+        self.norms = norms
+        self.labels = list(labels)
+        self.shortlist = shortlist
+        self._group()
+
+    def __len__(self):
+        return len(self.encodings)
+
+    def _group(self):
+        """Per-identity member lists, centroids and radii over rows that are not masked"""
+        live = np.flatnonzero(np.isfinite(self.norms))
+        names, inverse = np.unique(np.asarray(self.labels, dtype=object)[live].astype(str), return_inverse=True)
+        # Members of identity i are order[offsets[i]:offsets[i + 1]]
+        by_identity = np.argsort(inverse, kind="stable")
+        self.order = live[by_identity].astype(np.int64)
+        counts = np.bincount(inverse, minlength=len(names))
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+        dim = self.encodings.shape[1]
+        sums = np.zeros((len(names), dim), dtype=np.float64)
+        np.add.at(sums, inverse, self.encodings[live])
+        self.centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+        self.centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        member_distances = np.linalg.norm(self.encodings[live] - self.centroids[inverse], axis=1)
+        self.radii = np.zeros(len(names), dtype=np.float32)
+        np.maximum.at(self.radii, inverse, member_distances.astype(np.float32))
+
+    def search(self, queries, k=1):
+        """Distances and ids of the k nearest encodings within the shortlisted identities"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.encodings.shape[1])
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if len(queries) == 0 or len(self.centroids) == 0:
+            return distances[:, :0], ids[:, :0]
+
+        centroid_distances = np.sqrt(squared_distances(queries, self.centroids, self.centroid_norms))
+        lower = centroid_distances - self.radii
+        upper = centroid_distances + self.radii
+        bound_k = min(k, len(self.centroids))
+        for row, query in enumerate(queries):
+            # Every identity has a member within its upper bound, so k of them bound the k-th nearest
+            bound = np.partition(upper[row], bound_k - 1)[bound_k - 1]
+            candidates = np.flatnonzero(lower[row] <= bound)
+            if self.shortlist and len(candidates) > self.shortlist:
+                candidates = candidates[np.argsort(lower[row][candidates], kind="stable")[:self.shortlist]]
+            members = np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in candidates])
+            squared = squared_distances(query[None, :], self.encodings[members], self.norms[members])
+            best, columns = top_k(squared, k)
+            found = best.shape[1]
+            distances[row, :found] = np.sqrt(best[0])
+            ids[row, :found] = members[columns[0]]
+
+        filled = min(k, len(self.order))
+        return distances[:, :filled], ids[:, :filled]
+
+    def appended(self, encodings, labels=None):
+        """Index over encodings/labels extending this one; groups are recomputed, no training needed"""
+        new = encodings[len(self.encodings):]
+        norms = np.concatenate((self.norms, np.einsum("ij,ij->i", new, new)))
+        return IdentityIndex(encodings, labels, self.shortlist, norms)
+
+    def masked(self, ids):
+        masked = _masked(self, ids)
+        masked._group()
+        return masked
+
+    def state(self):
+        return {}
+
+
+def _masked(index, ids):
+    """Copy of index that can no longer return ids: their norms become infinite"""
+    index = copy.copy(index)
+    index.norms = index.norms.copy()
+    index.norms[np.asarray(list(ids), dtype=np.int64)] = np.inf
+    return index
+
+
+INDEX_TYPES = {index_type.kind: index_type for index_type in (FlatIndex, IVFIndex, IdentityIndex)}
+
+
+def build_index(encodings, kind="flat", labels=None, **options):
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index kind {kind!r}, expected one of {sorted(INDEX_TYPES)}")
+    index_type = INDEX_TYPES[kind]
+    if getattr(index_type, "needs_labels", False):
+        if labels is None:
+            raise ValueError(f"The {kind} index needs the name of every encoding")
+        return index_type(encodings, labels, **options)
+    return index_type(encodings, **options)
+
+
+def index_path_for(database_file):
+    """Index file persisted next to the pickled database"""
+    return os.path.splitext(database_file)[0] + INDEX_SUFFIX
+
+
+def save_index(index, path):
+    np.savez(path, kind=index.kind, fingerprint=fingerprint(index.encodings), **index.state())
+
+
+def load_index(path, encodings):
+    """Load a persisted index, or None if it is missing or was built from another gallery"""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        kind = str(data["kind"])
+        if kind not in INDEX_TYPES or str(data["fingerprint"]) != fingerprint(encodings):
+            return None
+        state = {key: data[key] for key in data.files if key not in ("kind", "fingerprint")}
+    return INDEX_TYPES[kind].from_state(encodings, state)
+
+
+def load_or_build_index(database_file, encodings, kind="flat", labels=None, **options):
+    """Reuse the index persisted next to database_file, rebuilding it when stale"""
+    if len(encodings) > 0:
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1)
+    else:
+        encodings = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+    if kind in (FlatIndex.kind, IdentityIndex.kind):
+        # Nothing to train, building is as cheap as loading
+        return build_index(encodings, kind, labels, **options)
+
+    path = index_path_for(database_file)
+    try:
+        index = load_index(path, encodings)
+        if index is not None and index.kind == kind:
+            if "n_probe" in options:
+                index.n_probe = options["n_probe"]
+            print(f"✅ Loaded {kind} face index from {path}")
+            return index
+    except Exception as e:
+        print(f"⚠️ Could not read face index {path}: {e}")
+
+    print(f"🔧 Building {kind} face index for {len(encodings)} encodings...")
+    index = build_index(encodings, kind, **options)
+    try:
+        save_index(index, path)
+    except OSError as e:
+        print(f"⚠️ Could not save face index to {path}: {e}")
+    return index
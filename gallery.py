@@ -0,0 +1,136 @@
+import numpy as np
+
+from face_index import ENCODING_SIZE, FlatIndex
+
+# Same default threshold face_recognition.compare_faces uses
+DEFAULT_TOLERANCE = 0.6
+MIN_CAPACITY = 64  # Rows reserved when a gallery first grows in place
+REBUILD_FRACTION = 0.5  # Rebuild instead of updating once this share of rows would be removed
+
+
+class FaceGallery:
+    """Known face encodings packed into one contiguous float32 matrix.
+
+    All the faces found in a frame are matched in one batch instead of one
+    compare_faces/face_distance pass per face. Nearest neighbour lookups go
+    through a pluggable index (see face_index.py), exact brute force by
+    default.
+
+    A gallery is an immutable snapshot. apply() returns a new one with rows
+    appended into spare capacity of a shared buffer (beyond the rows any
+    older snapshot can see) and removed rows masked out, so frames still
+    being matched against the old snapshot are unaffected.
+    """
+
+    def __init__(self, encodings, names, tolerance=DEFAULT_TOLERANCE, index=None):
+        self.names = list(names)
+        self.tolerance = tolerance
+        self.removed = frozenset()
+        self.version = 0
+        # [array, rows in use] shared by the snapshots that append in place
+        self.buffer = None
+
+        if index is not None:
+            matrix = index.encodings
+        elif len(self.names) > 0:
+            matrix = np.asarray(encodings, dtype=np.float32).reshape(len(self.names), -1)
+        else:
+            matrix = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+
+        self.index = index if index is not None else FlatIndex(matrix)
+        self.encodings = self.index.encodings
+
+    def __len__(self):
+        return len(self.names) - len(self.removed)
+
+    def _grow(self, added):
+        """Encodings of this gallery followed by added, copying only when out of capacity"""
+        rows, count = len(self.names), len(added)
+        buffer = self.buffer
+        if buffer is None or buffer[1] != rows or rows + count > len(buffer[0]):
+            capacity = max(2 * (rows + count), MIN_CAPACITY)
+            array = np.empty((capacity, self.encodings.shape[1]), dtype=np.float32)
+            array[:rows] = self.encodings
+            buffer = [array, rows]
+        buffer[0][rows:rows + count] = added
+        buffer[1] = rows + count
+        return buffer[0][:rows + count], buffer
+
+    def apply(self, added_encodings, added_names, removed_ids=()):
+        """New snapshot with rows appended and rows removed; this one stays valid"""
+        added = np.asarray(added_encodings, dtype=np.float32).reshape(-1, self.encodings.shape[1])
+        index, buffer = self.index, self.buffer
+        if len(added):
+            encodings, buffer = self._grow(added)
+            index = index.appended(encodings, self.names + list(added_names))
+        if len(removed_ids):
+            index = index.masked(removed_ids)
+        gallery = FaceGallery(None, self.names + list(added_names), self.tolerance, index)
+        gallery.removed = self.removed | frozenset(int(i) for i in removed_ids)
+        gallery.version = self.version + 1
+        gallery.buffer = buffer
+        return gallery
+
+    def changes_to(self, encodings, names):
+        """(added_encodings, added_names, removed_ids) turning this gallery into encodings/names.
+
+        Rows are matched by name and exact encoding. Returns None when a full
+        rebuild is the better choice: an empty gallery, or too many removed rows.
+        """
+        if len(self.names) == 0:
+            return None
+        current = self._live_rows()
+
+        added_encodings, added_names = [], []
+        for name, row in zip(names, np.asarray(encodings, dtype=np.float32).reshape(len(names), -1)):
+            ids = current.get((name, row.tobytes()))
+            if ids:
+                ids.pop()
+            else:
+                added_encodings.append(row)
+                added_names.append(name)
+        removed_ids = sorted(i for ids in current.values() for i in ids)
+
+        if len(self.removed) + len(removed_ids) > REBUILD_FRACTION * (len(self.names) + len(added_names)):
+            return None
+        return added_encodings, added_names, removed_ids
+
+    def _live_rows(self):
+        """{(name, encoding bytes): [row ids]} of the rows not removed"""
+        rows = {}
+        for i, (name, row) in enumerate(zip(self.names, self.encodings)):
+            if i not in self.removed:
+                rows.setdefault((name, row.tobytes()), []).append(i)
+        return rows
+
+    def row_ids(self, names, encodings):
+        """Ids of live rows holding these name/encoding pairs; pairs not in this gallery are skipped"""
+        current = self._live_rows()
+        ids = []
+        for name, row in zip(names, np.asarray(encodings, dtype=np.float32).reshape(len(names), -1)):
+            matching = current.get((name, row.tobytes()))
+            if matching:
+                ids.append(matching.pop())
+        return sorted(ids)
+
+    def match(self, face_encodings, k=1):
+        """Top-k (name, distance) candidates for each query encoding, closest first"""
+        distances, ids = self.index.search(face_encodings, k)
+        return [
+            [(self.names[index], float(distance)) for index, distance in zip(row, row_distances)
+             if index >= 0 and np.isfinite(distance)]
+            for row, row_distances in zip(ids, distances)
+        ]
+
+    def identify(self, face_encodings):
+        """Best matching name for each encoding, or "Unknown" when above tolerance"""
+        return self.identify_with_distances(face_encodings)[0]
+
+    def identify_with_distances(self, face_encodings):
+        """(names, distances) of the best match for each encoding; distance is inf without any match"""
+        recognized_names, distances = [], []
+        for candidates in self.match(face_encodings, k=1):
+            distance = candidates[0][1] if candidates else float("inf")
+            recognized_names.append(candidates[0][0] if distance <= self.tolerance else "Unknown")
+            distances.append(distance)
+        return recognized_names, distances
@@ -0,0 +1,113 @@
+import os
+import signal
+import threading
+
+RELOAD_POLL_INTERVAL = 2.0  # Seconds between checks of the database files for changes
+
+
+class GalleryStore:
+    """Owns the current FaceGallery and replaces it without stopping recognition.
+
+    Readers never lock: they pick up the current snapshot once per frame (or
+    batch) and keep using it, so in-flight frames finish on the gallery they
+    started with. reload() re-reads the database in the calling thread,
+    diffs it against the current snapshot and applies only the added and
+    removed rows, falling back to a full rebuild when the diff is too large.
+    Every subscriber is called with (gallery, changes), where changes is the
+    applied (added_encodings, added_names, removed_ids) or None after a
+    rebuild.
+
+    A watcher thread reloads when any of the watched files changes, and on
+    POSIX systems SIGHUP triggers a reload as well.
+    """
+
+    def __init__(self, load_database, build_gallery, watch_paths=(), poll_interval=RELOAD_POLL_INTERVAL):
+        self.load_database = load_database
+        self.build_gallery = build_gallery
+        self.watch_paths = list(watch_paths)
+        self.poll_interval = poll_interval
+        self.gallery = build_gallery(*load_database())
+        self.subscribers = []
+        self.reload_lock = threading.Lock()
+        self.reload_requested = threading.Event()
+        self.running = True
+        self.reloads = 0
+        self.rebuilds = 0
+        self.mtimes = self._mtimes()
+        self.watcher = None
+
+    @property
+    def current(self):
+        return self.gallery
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def _swap(self, gallery, changes):
+        self.gallery = gallery
+        for callback in self.subscribers:
+            try:
+                callback(gallery, changes)
+            except Exception as e:
+                print(f"❌ Error publishing reloaded gallery: {e}")
+
+    def reload(self):
+        """Bring the gallery up to date with the database files"""
+        with self.reload_lock:
+            encodings, names = self.load_database()
+            current = self.gallery
+            changes = current.changes_to(encodings, names)
+            if changes is None:
+                gallery = self.build_gallery(encodings, names)
+                gallery.version = current.version + 1
+                self.rebuilds += 1
+                print(f"🔄 Rebuilt face gallery: {len(gallery)} encodings")
+            else:
+                added_encodings, added_names, removed_ids = changes
+                if not added_names and not removed_ids:
+                    return
+                gallery = current.apply(added_encodings, added_names, removed_ids)
+                print(f"🔄 Updated face gallery: {len(added_names)} added, {len(removed_ids)} removed, "
+                      f"{len(gallery)} encodings")
+            self.reloads += 1
+            self._swap(gallery, changes)
+
+    def request_reload(self, *_):
+        """Ask the watcher thread to reload; safe to call from a signal handler"""
+        self.reload_requested.set()
+
+    def _mtimes(self):
+        return [os.stat(path).st_mtime_ns if os.path.exists(path) else None for path in self.watch_paths]
+
+    def _watch(self):
+        while self.running:
+            requested = self.reload_requested.wait(self.poll_interval)
+            self.reload_requested.clear()
+            if not self.running:
+                break
+            mtimes = self._mtimes()
+            if requested or mtimes != self.mtimes:
+                self.mtimes = mtimes
+                try:
+                    self.reload()
+                except Exception as e:
+                    # Keep serving the old snapshot, e.g. while enroll.py is halfway through writing
+                    print(f"❌ Error reloading face database: {e}")
+                    self.mtimes = None
+
+    def start_watching(self):
+        if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, self.request_reload)
+        self.watcher = threading.Thread(target=self._watch, name="gallery-reload")
+        self.watcher.daemon = True
+        self.watcher.start()
+
+    def stop(self):
+        self.running = False
+        self.reload_requested.set()
+        if self.watcher is not None:
+            self.watcher.join()
+
+    def stats(self):
+        return {"encodings": len(self.gallery), "version": self.gallery.version,
+                "reloads": self.reloads, "rebuilds": self.rebuilds}
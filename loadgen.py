@@ -0,0 +1,260 @@
+"""Headless load generator for server.py.
+
+Simulates N cameras that each stream JPEG frames over the >L protocol at a
+fixed frame rate, whether or not the server keeps up, and reports response
+latency percentiles, throughput, and frames the server dropped or answered
+late. Frames come from a video file, a directory of images, or synthetic
+noise:
+
+    python loadgen.py --video lobby.mp4 --cameras 16 --fps 10 --duration 60
+    python loadgen.py --frames recorded/ --cameras 4 --protocol json --output run.json
+
+Latency is measured from the moment a frame was sent to the moment its
+response arrived. Responses carry the server's frame sequence number, so
+frames the server dropped as stale (--pipeline) are counted as dropped
+rather than mismatched.
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from protocol import (FrameReader, BinaryResponseDecoder, PROTOCOL_BINARY, PROTOCOL_JSON, pack_hello,
+                      pack_message, parse_hello)
+
+FRAME_WIDTH = 320  # Frames are resized to the server's default detection width
+JPEG_QUALITY = 70
+MAX_SOURCE_FRAMES = 300  # Frames kept in memory from a video or image directory
+LATE_MS = 500.0  # Responses slower than this count as late
+
+
+def load_video(path, width, quality, max_frames):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    try:
+        while len(frames) < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(encode_frame(frame, width, quality))
+    finally:
+        capture.release()
+    return frames
+
+
+def load_directory(path, width, quality, max_frames):
+    frames = []
+    for filename in sorted(os.listdir(path)):
+        if len(frames) >= max_frames:
+            break
+        frame = cv2.imread(os.path.join(path, filename))
+        if frame is not None:
+            frames.append(encode_frame(frame, width, quality))
+    return frames
+
+
+def synthetic_frames(count, width, quality, seed=0):
+    rng = np.random.default_rng(seed)
+    height = width * 3 // 4
+    base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    # Shift the scene every frame so motion gating does not answer from cache
+    return [encode_frame(np.roll(base, i * 7, axis=1), width, quality) for i in range(count)]
+
+
+def encode_frame(frame, width, quality):
+    if frame.shape[1] != width:
+        height = max(1, int(round(frame.shape[0] * width / frame.shape[1])))
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = np.asarray(values)
+    return {"p50": float(np.percentile(values, 50)), "p90": float(np.percentile(values, 90)),
+            "p99": float(np.percentile(values, 99)), "max": float(values.max()), "mean": float(values.mean())}
+
+
+class SimulatedCamera:
+    """One connection sending frames on a fixed schedule and timing the responses"""
+
+    def __init__(self, camera_id, host, port, frames, fps, duration, protocol, late_ms):
+        self.camera_id = camera_id
+        self.host = host
+        self.port = port
+        self.frames = frames
+        self.fps = fps
+        self.duration = duration
+        self.protocol = protocol
+        self.late_ms = late_ms
+        self.sent_at = {}
+        self.latencies = []
+        self.frames_sent = 0
+        self.responses = 0
+        self.dropped = 0
+        self.late = 0
+        self.behind_schedule = 0
+        self.last_seq = 0
+        self.error = None
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        decoder = None
+        if self.protocol == PROTOCOL_BINARY:
+            sock.sendall(pack_hello(PROTOCOL_BINARY))
+            reply = FrameReader(sock).read_message()
+            if reply is not None and parse_hello(reply) == PROTOCOL_BINARY:
+                decoder = BinaryResponseDecoder()
+        return sock, decoder
+
+    def _receive(self, sock, decoder):
+        reader = FrameReader(sock)
+        while True:
+            try:
+                payload = reader.read_message()
+            except OSError:
+                return
+            if payload is None:
+                return
+            received_at = time.perf_counter()
+            response = decoder.decode(payload) if decoder is not None else json.loads(str(payload, "utf-8"))
+            if response is None:
+                continue
+            # Servers without frame_seq answer every frame in order
+            frame_seq = response.get("frame_seq") or self.last_seq + 1
+            sent_at = self.sent_at.pop(frame_seq, None)
+            # Frames skipped between two answers were dropped by the server
+            self.dropped += max(0, frame_seq - self.last_seq - 1)
+            for seq in range(self.last_seq + 1, frame_seq):
+                self.sent_at.pop(seq, None)
+            self.last_seq = max(self.last_seq, frame_seq)
+            self.responses += 1
+            if sent_at is not None:
+                latency_ms = (received_at - sent_at) * 1000
+                self.latencies.append(latency_ms)
+                if latency_ms > self.late_ms:
+                    self.late += 1
+
+    def run(self):
+        try:
+            sock, decoder = self._connect()
+        except OSError as e:
+            self.error = str(e)
+            return
+        receiver = threading.Thread(target=self._receive, args=(sock, decoder), daemon=True)
+        receiver.start()
+        interval = 1.0 / self.fps
+        start = time.perf_counter()
+        try:
+            while True:
+                due = start + self.frames_sent * interval
+                now = time.perf_counter()
+                if now - start >= self.duration:
+                    break
+                if due > now:
+                    time.sleep(due - now)
+                elif now - due > interval:
+                    self.behind_schedule += 1
+                frame = self.frames[(self.camera_id + self.frames_sent) % len(self.frames)]
+                self.sent_at[self.frames_sent + 1] = time.perf_counter()
+                sock.sendall(pack_message(frame))
+                self.frames_sent += 1
+            # Give the last responses a moment to arrive
+            deadline = time.perf_counter() + max(1.0, self.late_ms / 1000)
+            while self.last_seq < self.frames_sent and time.perf_counter() < deadline:
+                time.sleep(0.01)
+        except OSError as e:
+            self.error = str(e)
+        finally:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+            receiver.join(timeout=1)
+
+    def summary(self):
+        return {
+            "camera": self.camera_id,
+            "frames_sent": self.frames_sent,
+            "responses": self.responses,
+            "dropped": self.dropped,
+            "lost": max(0, self.frames_sent - self.last_seq),
+            "late": self.late,
+            "behind_schedule": self.behind_schedule,
+            "latency_ms": percentiles(self.latencies),
+            "error": self.error,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--video", help="Video file to replay")
+    source.add_argument("--frames", help="Directory of recorded frames (JPEG/PNG) to replay")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--fps", type=float, default=10.0, help="Frames per second per camera")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to send frames")
+    parser.add_argument("--width", type=int, default=FRAME_WIDTH, help="Width frames are resized to")
+    parser.add_argument("--quality", type=int, default=JPEG_QUALITY)
+    parser.add_argument("--protocol", choices=["binary", "json"], default="binary")
+    parser.add_argument("--late-ms", type=float, default=LATE_MS)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.video:
+        frames = load_video(args.video, args.width, args.quality, MAX_SOURCE_FRAMES)
+    elif args.frames:
+        frames = load_directory(args.frames, args.width, args.quality, MAX_SOURCE_FRAMES)
+    else:
+        frames = synthetic_frames(60, args.width, args.quality)
+    if not frames:
+        parser.error("No frames could be read from the source")
+
+    protocol = PROTOCOL_BINARY if args.protocol == "binary" else PROTOCOL_JSON
+    cameras = [SimulatedCamera(i, args.host, args.port, frames, args.fps, args.duration, protocol, args.late_ms)
+               for i in range(args.cameras)]
+    threads = [threading.Thread(target=camera.run) for camera in cameras]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    per_camera = [camera.summary() for camera in cameras]
+    latencies = [latency for camera in cameras for latency in camera.latencies]
+    responses = sum(camera.responses for camera in cameras)
+    results = {
+        "cameras": args.cameras,
+        "fps_per_camera": args.fps,
+        "duration": args.duration,
+        "protocol": args.protocol,
+        "frame_bytes": int(np.mean([len(frame) for frame in frames])),
+        "frames_sent": sum(camera.frames_sent for camera in cameras),
+        "responses": responses,
+        "dropped": sum(summary["dropped"] for summary in per_camera),
+        "lost": sum(summary["lost"] for summary in per_camera),
+        "late": sum(camera.late for camera in cameras),
+        "throughput_fps": responses / elapsed if elapsed else 0.0,
+        "latency_ms": percentiles(latencies),
+        "per_camera": per_camera,
+    }
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
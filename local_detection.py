@@ -0,0 +1,122 @@
+import os
+import threading
+
+import cv2
+
+from pipeline import LatestFrameSlot
+from tracking import iou
+
+DETECT_WIDTH = 320  # Frames are shrunk to this width before running the cascade
+DETECT_EVERY = 3  # Run the cascade on every Nth frame, reuse the boxes in between
+MIN_FACE_SIZE = 30  # Smallest face in full-frame pixels
+SMOOTHING = 0.5  # Weight of the previous box when a face is detected again
+
+
+class LocalFaceDetector:
+    """Haar cascade face detector that loads its model once.
+
+    Detection runs on a downscaled, equalized grayscale copy of the frame and
+    only on every detect_every-th call; the calls in between return the last
+    boxes. Faces found again overlap their previous box and are smoothed
+    towards it so the overlay does not jitter. Boxes are returned as
+    top/right/bottom/left dicts in full-frame coordinates, the same format as
+    the server's face locations.
+    """
+
+    def __init__(self, cascade_path, detect_width=DETECT_WIDTH, detect_every=DETECT_EVERY,
+                 min_face_size=MIN_FACE_SIZE):
+        if not os.path.isfile(cascade_path):
+            raise FileNotFoundError(f"Haar cascade file not found at {cascade_path}")
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+        if self.cascade.empty():
+            raise ValueError(f"Haar cascade file {cascade_path} could not be loaded")
+        self.detect_width = detect_width
+        self.detect_every = max(1, detect_every)
+        self.min_face_size = min_face_size
+        self.boxes = []
+        self.calls = 0
+        self.detections = 0
+
+    def _detect(self, frame):
+        scale = min(1.0, self.detect_width / float(frame.shape[1]))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if scale < 1.0:
+            gray = cv2.resize(gray, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.equalizeHist(gray)
+        min_size = max(12, int(self.min_face_size * scale))
+        faces = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_size, min_size))
+        return [(int(y / scale), int((x + w) / scale), int((y + h) / scale), int(x / scale))
+                for (x, y, w, h) in faces]
+
+    def _smooth(self, boxes):
+        smoothed = []
+        for box in boxes:
+            previous = max(self.boxes, key=lambda old: iou(old, box), default=None)
+            if previous is not None and iou(previous, box) > 0:
+                box = tuple(int(round(SMOOTHING * old + (1 - SMOOTHING) * new)) for old, new in zip(previous, box))
+            smoothed.append(box)
+        return smoothed
+
+    def detect(self, frame):
+        if self.calls % self.detect_every == 0:
+            self.boxes = self._smooth(self._detect(frame))
+            self.detections += 1
+        self.calls += 1
+        return [{"top": top, "right": right, "bottom": bottom, "left": left}
+                for (top, right, bottom, left) in self.boxes]
+
+    def stats(self):
+        return {"frames": self.calls, "detections": self.detections, "faces": len(self.boxes)}
+
+
+class BackgroundFaceDetector:
+    """Runs a LocalFaceDetector on its own thread so the display loop never waits.
+
+    submit() hands over the newest frame (older unprocessed frames are
+    dropped); latest() returns the most recent (sequence number, frame, faces,
+    captured_at) so callers can tell whether a detection is new and use the
+    exact frame its boxes refer to. Only frames the cascade actually ran on
+    are published: in between, the detector returns boxes of an older frame
+    that would not line up with the new one.
+    """
+
+    def __init__(self, detector):
+        self.detector = detector
+        self.frames = LatestFrameSlot()
+        self.lock = threading.Lock()
+        self.result = (0, None, [], None)
+        self.thread = threading.Thread(target=self._run, name="local-detection")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, frame, captured_at=None):
+        self.frames.put((frame, captured_at))
+
+    def latest(self):
+        with self.lock:
+            return self.result
+
+    @property
+    def faces(self):
+        return self.latest()[2]
+
+    def stop(self):
+        self.frames.close()
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            frame, captured_at = item
+            detections = self.detector.detections
+            try:
+                faces = self.detector.detect(frame)
+            except Exception as e:
+                print(f"❌ Error detecting faces locally: {e}")
+                continue
+            if self.detector.detections == detections:
+                continue
+            with self.lock:
+                self.result = (self.result[0] + 1, frame, faces, captured_at)
@@ -0,0 +1,213 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = 9108  # Local port serving the Prometheus text endpoint
+# Upper bounds (seconds) of the stage latency histogram buckets
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Stages of the recognition hot path, in the order a frame goes through them
+STAGES = ("recv", "imdecode", "resize", "face_locations", "face_encodings", "matching", "log_write", "sendall")
+METRIC_PREFIX = "face_server"
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; observe() is a bisect and three additions"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += seconds
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.total, self.count
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile, in seconds"""
+        counts, _, count = self.snapshot()
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class ConnectionCounters:
+    def __init__(self):
+        self.frames = 0
+        self.faces = 0
+        self.granted = 0
+        self.denied = 0
+
+    def add(self, other):
+        self.frames += other.frames
+        self.faces += other.faces
+        self.granted += other.granted
+        self.denied += other.denied
+
+
+class ServerMetrics:
+    """Stage latency histograms and per-connection counters of the server.
+
+    Stages are timed where they run: recognition.py times decoding, resizing,
+    detection, encoding and matching, and the connection handlers time
+    receiving, access logging and sending. Stages that run in --workers
+    processes are recorded in those processes and do not show up here.
+
+    Counters are kept per live connection; when a connection closes they are
+    folded into the totals so the endpoint does not grow with every camera
+    that ever connected.
+    """
+
+    def __init__(self, log_sample=1):
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.connections = {}
+        self.closed = ConnectionCounters()
+        self.lock = threading.Lock()
+        self.log_sample = log_sample
+        # Occurrences seen so far of each sampled kind of output
+        self.logged = {}
+        # Event counters of other components, e.g. result cache hits
+        self.counters = {}
+
+    def observe(self, stage, started):
+        """Record the time since started (a time.perf_counter() value); returns the current time"""
+        now = time.perf_counter()
+        self.stages[stage].observe(now - started)
+        return now
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_result(self, connection, result):
+        with self.lock:
+            counters = self.connections.get(connection)
+            if counters is None:
+                counters = self.connections[connection] = ConnectionCounters()
+            counters.frames += 1
+            counters.faces += result["faces_detected"]
+            if result["access_granted"]:
+                counters.granted += 1
+            else:
+                counters.denied += 1
+
+    def close_connection(self, connection):
+        with self.lock:
+            counters = self.connections.pop(connection, None)
+            if counters is not None:
+                self.closed.add(counters)
+
+    def should_log(self, kind="result"):
+        """True for one in every log_sample frame results, or warnings of another kind (never when 0)"""
+        if self.log_sample <= 0:
+            return False
+        with self.lock:
+            seen = self.logged.get(kind, 0)
+            self.logged[kind] = seen + 1
+        return seen % self.log_sample == 0
+
+    def totals(self):
+        with self.lock:
+            totals = ConnectionCounters()
+            totals.add(self.closed)
+            for counters in self.connections.values():
+                totals.add(counters)
+            return totals, len(self.connections)
+
+    def stats(self):
+        totals, connections = self.totals()
+        stages = {}
+        for stage, histogram in self.stages.items():
+            if histogram.count:
+                stages[stage] = {"count": histogram.count,
+                                 "mean_ms": round(histogram.total / histogram.count * 1000, 2),
+                                 "p99_ms": histogram.quantile(0.99) * 1000}
+        with self.lock:
+            counters = dict(self.counters)
+        return {"connections": connections, "frames": totals.frames, "faces": totals.faces,
+                "granted": totals.granted, "denied": totals.denied, "stages": stages, **counters}
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        name = f"{METRIC_PREFIX}_stage_seconds"
+        lines = [f"# HELP {name} Time spent in each stage of the recognition path.", f"# TYPE {name} histogram"]
+        for stage, histogram in self.stages.items():
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+        with self.lock:
+            connections = [(str(connection), vars(counters).copy())
+                           for connection, counters in self.connections.items()]
+        totals, _ = self.totals()
+        for counter in ("frames", "faces", "granted", "denied"):
+            # Totals and live connections are separate families so sum() over either is correct
+            name = f"{METRIC_PREFIX}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {getattr(totals, counter)}")
+            name = f"{METRIC_PREFIX}_connection_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            for connection, counters in connections:
+                escaped = connection.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'{name}{{connection="{escaped}"}} {counters[counter]}')
+        with self.lock:
+            counters = sorted(self.counters.items())
+        for counter, value in counters:
+            lines.append(f"# TYPE {METRIC_PREFIX}_{counter}_total counter")
+            lines.append(f"{METRIC_PREFIX}_{counter}_total {value}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_connections gauge")
+        lines.append(f"{METRIC_PREFIX}_connections {len(connections)}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves ServerMetrics.render() over HTTP on a background thread"""
+
+    def __init__(self, metrics, port=METRICS_PORT, host="127.0.0.1"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                # Scrapes every few seconds would drown the server's own output
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# Shared by every connection handler and recognizer in this process
+registry = ServerMetrics()
@@ -0,0 +1,59 @@
+import time
+
+import cv2
+import numpy as np
+
+THUMBNAIL_WIDTH = 64  # Frames are compared as tiny grayscale thumbnails
+PIXEL_THRESHOLD = 12  # Gray-level difference for a thumbnail pixel to count as changed
+AREA_THRESHOLD = 0.01  # Fraction of changed pixels that makes a frame worth processing
+MAX_SKIP_SECONDS = 2.0  # Always re-run recognition at least this often
+
+
+def thumbnail(frame, width=THUMBNAIL_WIDTH):
+    """Small blurred grayscale version of a BGR frame for cheap comparisons"""
+    height = max(1, int(round(frame.shape[0] * width / frame.shape[1])))
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(small, (3, 3), 0)
+
+
+class MotionGate:
+    """Decides whether a frame changed enough since the last processed one.
+
+    Each frame is reduced to a thumbnail and compared with the thumbnail of
+    the last frame that went through recognition, so slow drifts still add
+    up to a change. Static scenes are skipped until max_skip seconds pass.
+    """
+
+    def __init__(self, pixel_threshold=PIXEL_THRESHOLD, area_threshold=AREA_THRESHOLD,
+                 max_skip=MAX_SKIP_SECONDS):
+        self.pixel_threshold = pixel_threshold
+        self.area_threshold = area_threshold
+        self.max_skip = max_skip
+        self.reference = None
+        self.reference_time = 0.0
+        self.frames_checked = 0
+        self.frames_skipped = 0
+
+    def should_process(self, frame, now=None):
+        now = time.monotonic() if now is None else now
+        current = thumbnail(frame)
+        self.frames_checked += 1
+
+        changed = (self.reference is None
+                   or self.reference.shape != current.shape
+                   or now - self.reference_time > self.max_skip)
+        if not changed:
+            diff = cv2.absdiff(current, self.reference)
+            changed_fraction = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+            changed = changed_fraction > self.area_threshold
+
+        if changed:
+            self.reference = current
+            self.reference_time = now
+        else:
+            self.frames_skipped += 1
+        return changed
+
+    def stats(self):
+        return {"frames_checked": self.frames_checked, "frames_skipped": self.frames_skipped}
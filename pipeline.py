@@ -0,0 +1,159 @@
+import queue
+import socket
+import threading
+import time
+
+from metrics import registry
+from protocol import FrameReader, negotiate
+from recognition import add_feedback
+
+RESPONSE_QUEUE_SIZE = 2
+
+
+class LatestFrameSlot:
+    """Single-item handoff where a newer frame replaces one not yet picked up"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.item = None
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = item
+            self.condition.notify()
+
+    def get(self):
+        """Wait for the newest frame; None once closed and drained"""
+        with self.condition:
+            while self.item is None and not self.closed:
+                self.condition.wait()
+            item, self.item = self.item, None
+            return item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+class ConnectionPipeline:
+    """Receive, recognize and respond stages of one connection on separate threads.
+
+    The receive stage keeps reading while inference runs and only the newest
+    frame waits for the recognizer, so when inference falls behind stale
+    frames are dropped rather than piling up in the TCP buffer. Results go
+    through a small bounded queue to the respond stage, which writes the
+    access log and sends the response.
+    """
+
+    def __init__(self, conn, addr, recognizer, handle_result, profile=None, first_message=None):
+        self.conn = conn
+        self.addr = addr
+        self.recognizer = recognizer
+        self.profile = profile
+        self.handle_result = handle_result
+        self.frames = LatestFrameSlot()
+        self.responses = queue.Queue(maxsize=RESPONSE_QUEUE_SIZE)
+        self.running = True
+        self.encoder = None
+        # Already read by the caller (to tell cameras from health probes)
+        self.first_message = first_message
+        self.frames_received = 0
+        self.frames_processed = 0
+
+    def run(self):
+        session = self.recognizer.open_session(self.profile)
+        stages = [
+            threading.Thread(target=self._recognize_stage, args=(session,), name=f"recognize-{self.addr}"),
+            threading.Thread(target=self._respond_stage, name=f"respond-{self.addr}"),
+        ]
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
+
+        try:
+            self._receive_stage()
+        finally:
+            self.frames.close()
+            for stage in stages:
+                stage.join()
+            self.recognizer.close_session(session)
+            print(f"📦 {self.addr}: {self.frames_received} frames received, "
+                  f"{self.frames_processed} processed, {self.frames.dropped} stale frames dropped")
+            self.conn.close()
+
+    def _receive_stage(self):
+        reader = FrameReader(self.conn)
+        while self.running:
+            try:
+                received = time.perf_counter()
+                if self.first_message is not None:
+                    frame_data, self.first_message = self.first_message, None
+                else:
+                    frame_data = reader.read_message()
+                    registry.observe("recv", received)
+            except Exception as e:
+                print(f"💥 Error: {e}")
+                break
+            if frame_data is None:
+                print("❌ Disconnected")
+                break
+            # The first message may be a protocol handshake instead of a frame
+            if self.encoder is None:
+                self.encoder, reply = negotiate(frame_data)
+                if reply is not None:
+                    self.conn.sendall(reply)
+                    continue
+            self.frames_received += 1
+            # The reader reuses its buffer for the next frame, so hand over a copy
+            self.frames.put((self.frames_received, time.perf_counter(), bytes(frame_data)))
+
+    def _recognize_stage(self, session):
+        try:
+            while True:
+                item = self.frames.get()
+                if item is None:
+                    break
+                frame_seq, received_at, frame_data = item
+                result = self.recognizer.recognize_encoded(frame_data, session)
+                self.frames_processed += 1
+                if result is None:
+                    print("⚠️ Frame decoding failed, skipping frame.")
+                    continue
+                # frame_seq also acknowledges the stale frames dropped before this one
+                self.responses.put(add_feedback(result, frame_seq, received_at, self.recognizer.queue_depth()))
+        except Exception as e:
+            print(f"💥 Error: {e}")
+            self._stop()
+        finally:
+            self.responses.put(None)
+
+    def _respond_stage(self):
+        while True:
+            result = self.responses.get()
+            if result is None:
+                break
+            try:
+                response = self.handle_result(result, self.addr, self.encoder)
+                sending = time.perf_counter()
+                self.conn.sendall(response)
+                registry.observe("sendall", sending)
+            except Exception as e:
+                print(f"💥 Error: {e}")
+                self._stop()
+                break
+        # Keep draining so the recognize stage never blocks on a full queue
+        while result is not None:
+            result = self.responses.get()
+
+    def _stop(self):
+        self.running = False
+        try:
+            # Unblock the receive stage if it is waiting in recv_into
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
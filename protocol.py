@@ -0,0 +1,300 @@
+import json
+import struct
+import time
+
+# Every message on the wire is a 4-byte big-endian length followed by the payload
+HEADER = struct.Struct(">L")
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # Reject length prefixes larger than this
+INITIAL_BUFFER_SIZE = 64 * 1024
+
+# Optional handshake: a client may open with HELLO_MAGIC + requested version.
+# JPEG frames start with 0xFFD8, so old clients that send frames straight away
+# are never mistaken for a handshake and keep getting JSON responses.
+HELLO_MAGIC = b"FRP\x00"
+HELLO = struct.Struct(">4sB")
+PROTOCOL_JSON = 1
+PROTOCOL_BINARY = 2
+PROTOCOL_CROPS = 3  # Binary responses, and the server accepts face crop uploads
+LATEST_PROTOCOL = PROTOCOL_CROPS
+# Health checks (balancer.py) say hello with this version and hang up after the
+# reply. Servers answer it in kind without opening a recognition session; older
+# servers answer with a JSON handshake, which is as good a sign of life.
+PROTOCOL_PROBE = 0
+# balancer.py appends the relayed camera's "host:port" (utf-8) to the handshake,
+# so backends log and pick detection profiles by the camera rather than the balancer
+MAX_FORWARDED_ADDRESS = 255
+
+# Binary (version 2) response messages, all little-endian, first byte is the type:
+#   RESULT: type, flags (bit 0 access granted, bit 1 cached), face count, unix time,
+#           frame sequence number, then uint16 processing ms, queue depth, frame width
+#           and detection width, then count * (top, right, bottom, left) int16 boxes,
+#           then count uint16 name ids
+#   NAMES:  type, entry count, then per entry uint16 id, uint8 length, utf-8 name
+MSG_RESULT = 1
+MSG_NAMES = 2
+RESULT_HEADER = struct.Struct("<BBHIIHHHH")
+NAMES_HEADER = struct.Struct("<BH")
+NAME_ENTRY = struct.Struct("<HB")
+UNKNOWN_ID = 0xFFFF
+FLAG_GRANTED = 1
+FLAG_CACHED = 2
+FRAME_SEQ = struct.Struct("<I")
+RESULT_SEQ_OFFSET = struct.calcsize("<BBHI")  # Byte offset of frame_seq in a RESULT message
+
+# Face crop upload (client to server, version 3), little-endian:
+#   CROPS_MAGIC, frame width, frame height, crop count, then per crop the face box
+#   (top, right, bottom, left) and crop region (x, y, width, height) in frame
+#   coordinates and the JPEG length, then every crop's JPEG bytes in order.
+#   The JPEG may be smaller than the crop region; the server rescales the box.
+CROPS_MAGIC = b"FRC\x00"
+CROPS_HEADER = struct.Struct("<4sHHB")
+CROP_ENTRY = struct.Struct("<hhhhhhHHI")
+MAX_CROPS = 255
+
+
+def _uint16(value):
+    return max(0, min(int(value), 0xFFFF))
+
+
+def pack_message(payload):
+    return HEADER.pack(len(payload)) + payload
+
+
+def pack_hello(version, camera=None):
+    """Framed handshake; camera is the (host, port) a balancer relays for"""
+    payload = HELLO.pack(HELLO_MAGIC, version)
+    if camera is not None:
+        payload += f"{camera[0]}:{camera[1]}".encode()[:MAX_FORWARDED_ADDRESS]
+    return pack_message(payload)
+
+
+def parse_hello(payload):
+    """Protocol version requested by a handshake message, None for anything else"""
+    if not HELLO.size <= len(payload) <= HELLO.size + MAX_FORWARDED_ADDRESS:
+        return None
+    if bytes(payload[:4]) != HELLO_MAGIC:
+        return None
+    return HELLO.unpack_from(payload)[1]
+
+
+def forwarded_camera(payload):
+    """(host, port) of the camera a balancer relays in this handshake, None if there is none"""
+    if parse_hello(payload) is None or len(payload) == HELLO.size:
+        return None
+    host, _, port = bytes(payload[HELLO.size:]).decode("utf-8", "replace").rpartition(":")
+    if not host or not port.isdigit():
+        return None
+    return host, int(port)
+
+
+def is_probe(payload):
+    return parse_hello(payload) == PROTOCOL_PROBE
+
+
+def pack_crops(frame_width, frame_height, crops):
+    """Framed crop upload; crops are (face_box, crop_region, jpeg_bytes) tuples"""
+    crops = crops[:MAX_CROPS]
+    entries = [CROP_ENTRY.pack(*box, *region, len(jpeg)) for box, region, jpeg in crops]
+    payload = CROPS_HEADER.pack(CROPS_MAGIC, frame_width, frame_height, len(crops))
+    return pack_message(payload + b"".join(entries) + b"".join(jpeg for _, _, jpeg in crops))
+
+
+def is_crop_upload(payload):
+    return len(payload) >= CROPS_HEADER.size and bytes(payload[:4]) == CROPS_MAGIC
+
+
+def parse_crops(payload):
+    """(frame_width, frame_height, [(face_box, crop_region, jpeg_view)]) of a crop upload"""
+    _, frame_width, frame_height, count = CROPS_HEADER.unpack_from(payload)
+    view = memoryview(payload)
+    offset = CROPS_HEADER.size
+    data_offset = offset + count * CROP_ENTRY.size
+    crops = []
+    for _ in range(count):
+        values = CROP_ENTRY.unpack_from(payload, offset)
+        offset += CROP_ENTRY.size
+        length = values[8]
+        if data_offset + length > len(view):
+            raise ValueError("Crop upload is shorter than its crop table")
+        crops.append((values[:4], values[4:8], view[data_offset:data_offset + length]))
+        data_offset += length
+    return frame_width, frame_height, crops
+
+
+class JsonResponseEncoder:
+    version = PROTOCOL_JSON
+
+    def encode(self, response):
+        return pack_message(json.dumps(response).encode())
+
+
+class BinaryResponseEncoder:
+    """Packs results into RESULT messages, sending each name once in a NAMES message"""
+
+    version = PROTOCOL_BINARY
+
+    def __init__(self):
+        self.name_ids = {}
+
+    def encode(self, response):
+        names = response["recognized"]
+        new_names = [name for name in dict.fromkeys(names)
+                     if name != "Unknown" and name not in self.name_ids]
+        messages = b""
+        if new_names:
+            entries = []
+            for name in new_names:
+                self.name_ids[name] = len(self.name_ids)
+                # The length field is one byte; cut on a character boundary so the client can decode it
+                encoded = name.encode()[:255].decode("utf-8", "ignore").encode()
+                entries.append(NAME_ENTRY.pack(self.name_ids[name], len(encoded)) + encoded)
+            messages += pack_message(NAMES_HEADER.pack(MSG_NAMES, len(entries)) + b"".join(entries))
+
+        locations = response["face_locations"]
+        count = len(locations)
+        flags = (FLAG_GRANTED if response["access_granted"] else 0) | (FLAG_CACHED if response.get("cached") else 0)
+        boxes = [value for box in locations for value in (box["top"], box["right"], box["bottom"], box["left"])]
+        ids = [self.name_ids.get(name, UNKNOWN_ID) for name in names]
+        # Faces without a name yet (no database loaded) are sent as Unknown
+        ids += [UNKNOWN_ID] * (count - len(ids))
+        payload = RESULT_HEADER.pack(MSG_RESULT, flags, count, int(time.time()), response.get("frame_seq", 0),
+                                     _uint16(response.get("processing_ms", 0)),
+                                     _uint16(response.get("queue_depth", 0)),
+                                     _uint16(response.get("frame_width", 0)),
+                                     _uint16(response.get("detect_width", 0)))
+        payload += struct.pack(f"<{4 * count}h{count}H", *boxes, *ids[:count])
+        return messages + pack_message(payload)
+
+
+class BinaryResponseDecoder:
+    """Client side of BinaryResponseEncoder, producing the same dicts as JSON"""
+
+    def __init__(self):
+        self.names = {UNKNOWN_ID: "Unknown"}
+
+    def decode(self, payload):
+        """Response dict for a RESULT message, None for a NAMES table update"""
+        message_type = payload[0]
+        if message_type == MSG_NAMES:
+            _, entries = NAMES_HEADER.unpack_from(payload)
+            offset = NAMES_HEADER.size
+            for _ in range(entries):
+                name_id, length = NAME_ENTRY.unpack_from(payload, offset)
+                offset += NAME_ENTRY.size
+                self.names[name_id] = str(payload[offset:offset + length], "utf-8")
+                offset += length
+            return None
+        if message_type != MSG_RESULT:
+            raise ValueError(f"Unknown response message type {message_type}")
+
+        (_, flags, count, timestamp, frame_seq, processing_ms, queue_depth,
+         frame_width, detect_width) = RESULT_HEADER.unpack_from(payload)
+        values = struct.unpack_from(f"<{4 * count}h{count}H", payload, RESULT_HEADER.size)
+        boxes, ids = values[:4 * count], values[4 * count:]
+        return {
+            "faces_detected": count,
+            "recognized": [self.names.get(name_id, "Unknown") for name_id in ids],
+            "access_granted": bool(flags & FLAG_GRANTED),
+            "cached": bool(flags & FLAG_CACHED),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)),
+            "face_locations": [
+                {"top": boxes[i], "right": boxes[i + 1], "bottom": boxes[i + 2], "left": boxes[i + 3]}
+                for i in range(0, 4 * count, 4)
+            ],
+            "frame_width": frame_width,
+            "frame_seq": frame_seq,
+            "processing_ms": processing_ms,
+            "queue_depth": queue_depth,
+            "detect_width": detect_width,
+        }
+
+
+def renumber_response(payload, version, offset):
+    """Add offset to the frame_seq of a response message.
+
+    Returns (message payload, new frame_seq), with frame_seq None for binary
+    NAMES messages and for JSON responses of servers that do not send one.
+    """
+    if version == PROTOCOL_JSON:
+        response = json.loads(str(payload, "utf-8"))
+        if "frame_seq" not in response:
+            return bytes(payload), None
+        response["frame_seq"] += offset
+        return json.dumps(response).encode(), response["frame_seq"]
+    if payload[0] != MSG_RESULT:
+        return bytes(payload), None
+    message = bytearray(payload)
+    frame_seq = FRAME_SEQ.unpack_from(message, RESULT_SEQ_OFFSET)[0] + offset
+    FRAME_SEQ.pack_into(message, RESULT_SEQ_OFFSET, frame_seq)
+    return bytes(message), frame_seq
+
+
+ENCODERS = {PROTOCOL_JSON: JsonResponseEncoder, PROTOCOL_BINARY: BinaryResponseEncoder,
+            PROTOCOL_CROPS: BinaryResponseEncoder}
+
+
+def negotiate(first_payload):
+    """Pick the response encoder from a connection's first message.
+
+    Returns (encoder, reply): reply is the framed handshake answer when the
+    message was a handshake, or None when it was already a frame from a
+    client that does not negotiate (which then gets JSON).
+    """
+    requested = parse_hello(first_payload)
+    if requested is None:
+        return JsonResponseEncoder(), None
+    version = max(v for v in ENCODERS if v <= max(requested, PROTOCOL_JSON))
+    return ENCODERS[version](), pack_hello(version)
+
+
+class FrameReader:
+    """Reads >L length-prefixed messages from a socket without intermediate copies.
+
+    Payloads are received with recv_into straight into one reusable bytearray
+    that only grows when a larger message arrives. read_message returns a
+    memoryview into that buffer, which stays valid until the next call, so it
+    can be handed directly to np.frombuffer/cv2.imdecode.
+    """
+
+    def __init__(self, sock, initial_size=INITIAL_BUFFER_SIZE, max_size=MAX_FRAME_SIZE):
+        self.sock = sock
+        self.max_size = max_size
+        self.header = bytearray(HEADER.size)
+        self.buffer = bytearray(initial_size)
+        self.view = memoryview(self.buffer)
+
+    def _grow(self, size):
+        capacity = len(self.buffer)
+        while capacity < size:
+            capacity *= 2
+        # Views handed out earlier keep the old buffer alive until they are dropped
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+
+    def _recv_exactly(self, view):
+        """Fill view completely; False if the peer closed before sending anything"""
+        received = 0
+        while received < len(view):
+            count = self.sock.recv_into(view[received:])
+            if count == 0:
+                if received == 0:
+                    return False
+                raise ConnectionError("Connection closed in the middle of a message")
+            received += count
+        return True
+
+    def read_message(self):
+        """Next payload as a memoryview, or None when the peer disconnected cleanly"""
+        with memoryview(self.header) as header:
+            if not self._recv_exactly(header):
+                return None
+        size, = HEADER.unpack(self.header)
+        if size > self.max_size:
+            raise ValueError(f"Message of {size} bytes exceeds the {self.max_size} byte limit")
+        if size > len(self.buffer):
+            self._grow(size)
+
+        payload = self.view[:size]
+        if size and not self._recv_exactly(payload):
+            raise ConnectionError("Connection closed in the middle of a message")
+        return payload
@@ -0,0 +1,113 @@
+import threading
+import time
+
+MIN_FPS = 2.0
+MAX_FPS = 15.0
+START_FPS = 10.0
+FPS_STEP = 0.5  # Frames per second added after each response from an idle server
+BACKOFF = 0.75  # Frame rate (and then resolution) multiplier when the server falls behind
+MIN_QUALITY = 30
+MAX_QUALITY = 80
+START_QUALITY = 50
+MIN_WIDTH = 160
+DEFAULT_WIDTH = 320  # Until the server reports the width it runs detection at
+MAX_IN_FLIGHT = 2  # Frames sent but not yet answered
+IN_FLIGHT_TIMEOUT = 2.0  # Seconds after which an unanswered frame is written off
+
+
+class AdaptiveRateController:
+    """Paces a client's frames from the load figures the server puts in each response.
+
+    Additive increase, multiplicative decrease: while the server answers
+    within one frame interval with nothing queued, frame rate and JPEG
+    quality creep up; once it reports a queue or falls behind they are cut,
+    and at the minimum frame rate the resolution is reduced as well. Frames
+    are never wider than the server's detection width, since anything larger
+    is scaled down on arrival anyway. At most max_in_flight frames are
+    outstanding; a response acknowledges its frame and every earlier one, so
+    frames the server dropped as stale do not hold up the window.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, min_fps=MIN_FPS, max_fps=MAX_FPS):
+        self.max_in_flight = max_in_flight
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.fps = min(START_FPS, max_fps)
+        self.quality = START_QUALITY
+        self.detect_width = DEFAULT_WIDTH
+        self.width = DEFAULT_WIDTH
+        self.lock = threading.Lock()
+        self.sent_seq = 0
+        self.acked_seq = 0
+        self.sent_at = {}
+        self.next_send = 0.0
+        self.rtt_ms = 0.0
+        self.frames_sent = 0
+        self.frames_written_off = 0
+
+    def ready(self, now=None):
+        """True when the next frame is due and the in-flight window has room"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            oldest = self.acked_seq + 1
+            if oldest in self.sent_at and now - self.sent_at[oldest] > IN_FLIGHT_TIMEOUT:
+                # No answer is coming (undecodable frame, lost response), stop waiting for it
+                self.sent_at.pop(oldest)
+                self.acked_seq = oldest
+                self.frames_written_off += 1
+            return now >= self.next_send and self.sent_seq - self.acked_seq < self.max_in_flight
+
+    def frame_size(self, frame_width, frame_height):
+        """(width, height) to resize a captured frame to before encoding"""
+        width = min(frame_width, self.width)
+        return width, max(1, int(round(frame_height * width / frame_width)))
+
+    def on_sent(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.sent_seq += 1
+            self.frames_sent += 1
+            self.sent_at[self.sent_seq] = now
+            self.next_send = now + 1.0 / self.fps
+
+    def on_response(self, response, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            # Servers without feedback answer every frame in order
+            frame_seq = response.get("frame_seq") or self.acked_seq + 1
+            sent_at = self.sent_at.get(frame_seq)
+            if sent_at is not None:
+                self.rtt_ms = (now - sent_at) * 1000
+            for seq in range(self.acked_seq + 1, frame_seq + 1):
+                self.sent_at.pop(seq, None)
+            self.acked_seq = max(self.acked_seq, min(frame_seq, self.sent_seq))
+
+            if response.get("detect_width"):
+                self.detect_width = response["detect_width"]
+            interval_ms = 1000.0 / self.fps
+            overloaded = response.get("queue_depth", 0) > 0 or response.get("processing_ms", 0) > interval_ms
+            if overloaded:
+                if self.fps > self.min_fps:
+                    self.fps = max(self.min_fps, self.fps * BACKOFF)
+                else:
+                    self.width = max(MIN_WIDTH, int(self.width * BACKOFF))
+                self.quality = max(MIN_QUALITY, self.quality - 5)
+            else:
+                if self.width < self.detect_width:
+                    self.width = min(self.detect_width, self.width + MIN_WIDTH // 4)
+                else:
+                    self.fps = min(self.max_fps, self.fps + FPS_STEP)
+                self.quality = min(MAX_QUALITY, self.quality + 1)
+            self.width = min(self.width, self.detect_width)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "fps": round(self.fps, 1),
+                "width": self.width,
+                "quality": self.quality,
+                "in_flight": self.sent_seq - self.acked_seq,
+                "rtt_ms": round(self.rtt_ms, 1),
+                "frames_sent": self.frames_sent,
+                "frames_written_off": self.frames_written_off,
+            }
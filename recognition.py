@@ -0,0 +1,445 @@
+import struct
+import time
+
+import cv2
+import face_recognition
+import numpy as np
+
+from metrics import registry
+from motion import MotionGate
+from protocol import is_crop_upload, parse_crops
+from result_cache import CACHE_SIZE, CACHE_TTL, ResultCache, difference_hash
+from tracking import FaceTracker
+
+# Frames wider than this are scaled down before detection for performance.
+# Clients learn it from each response and send frames no wider than that.
+DETECTION_WIDTH = 320
+DEFAULT_UPSAMPLE = 1  # HOG upsampling passes; each finds smaller faces at roughly 4x the cost
+DEFAULT_MODEL = "hog"
+REFINE_PADDING = 0.5  # Share of a coarse face box added on each side for the fine detection pass
+REFINE_FACTOR = 4  # Coarse-to-fine profiles ask clients for frames this much wider than the coarse pass
+
+
+def decode_frame(frame_data):
+    """Decode JPEG bytes (or any buffer) into a BGR frame, None if decoding fails"""
+    started = time.perf_counter()
+    frame_array = np.frombuffer(frame_data, dtype=np.uint8)
+    frame = cv2.imdecode(frame_array, cv2.IMREAD_COLOR)
+    registry.observe("imdecode", started)
+    return frame
+
+
+class FaceCrops:
+    """Decoded face crops uploaded by a client that ran face detection itself"""
+
+    def __init__(self, frame_width, frame_height, crops):
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        # (face_box, crop_region, BGR crop image) in frame coordinates
+        self.crops = crops
+
+
+def decode_crops(payload):
+    """Decode every crop of a crop upload, None if any of them cannot be decoded"""
+    try:
+        frame_width, frame_height, crops = parse_crops(payload)
+    except (ValueError, IndexError, struct.error):
+        return None
+    decoded = []
+    for face_box, crop_region, jpeg in crops:
+        image = decode_frame(jpeg)
+        if image is None:
+            return None
+        decoded.append((face_box, crop_region, image))
+    return FaceCrops(frame_width, frame_height, decoded)
+
+
+def decode_upload(frame_data):
+    """Decode a received message into a BGR frame or FaceCrops, None if that fails"""
+    if is_crop_upload(frame_data):
+        return decode_crops(frame_data)
+    return decode_frame(frame_data)
+
+
+def prepare_frame(frame, detect_width=DETECTION_WIDTH):
+    """Downscale a decoded BGR frame to at most detect_width and convert it to RGB.
+
+    Returns (rgb_small_frame, scale) where scale maps detection coordinates
+    back to the received frame. Frames that are already small enough are
+    only converted.
+    """
+    started = time.perf_counter()
+    width = frame.shape[1]
+    scale = 1.0
+    if width > detect_width:
+        height = max(1, int(round(frame.shape[0] * detect_width / width)))
+        frame = cv2.resize(frame, (detect_width, height), interpolation=cv2.INTER_AREA)
+        scale = width / detect_width
+    rgb_small_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    registry.observe("resize", started)
+    return rgb_small_frame, scale
+
+
+def detect_faces(rgb_small_frame, upsample=DEFAULT_UPSAMPLE, model=DEFAULT_MODEL):
+    started = time.perf_counter()
+    face_locations = face_recognition.face_locations(rgb_small_frame, number_of_times_to_upsample=upsample,
+                                                     model=model)
+    registry.observe("face_locations", started)
+    return face_locations
+
+
+def encode_faces(rgb_small_frame, face_locations):
+    if not face_locations:
+        return []
+    started = time.perf_counter()
+    face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
+    registry.observe("face_encodings", started)
+    return face_encodings
+
+
+def scale_locations(face_locations, scale=1.0):
+    """Convert (top, right, bottom, left) tuples back to received frame coordinates"""
+    return [
+        {"top": int(round(top * scale)), "right": int(round(right * scale)),
+         "bottom": int(round(bottom * scale)), "left": int(round(left * scale))}
+        for (top, right, bottom, left) in face_locations
+    ]
+
+
+def match_faces(gallery, face_encodings):
+    """(names, match distances) for each encoding; the distances feed the tracker's identity votes"""
+    if len(gallery) == 0:
+        registry.count("frames_without_gallery")
+        if registry.should_log("no_gallery"):
+            print("⚠️ No face database loaded, skipping recognition")
+        return ["Unknown"] * len(face_encodings), [float("inf")] * len(face_encodings)
+    if len(face_encodings) == 0:
+        return [], []
+    # Match every face in the frame against the gallery in one batch
+    started = time.perf_counter()
+    matches = gallery.identify_with_distances(face_encodings)
+    registry.observe("matching", started)
+    return matches
+
+
+def build_result(face_locations, recognized_names, scale=1.0, frame_width=0):
+    return {
+        "faces_detected": len(face_locations),
+        "recognized": recognized_names,
+        "access_granted": any(name != "Unknown" for name in recognized_names),
+        # Face locations in received frame size for client-side visualization
+        "face_locations": scale_locations(face_locations, scale),
+        # Width of the frame the locations refer to, so clients can map them to their display
+        "frame_width": frame_width,
+        # True when the scene had not changed and the previous result was reused
+        "cached": False,
+    }
+
+
+class DetectionProfile:
+    """How faces are looked for in one camera's frames, and what that costs.
+
+    detect_width is the width the frame (or its region of interest) is
+    scaled to before detection, upsample the number of HOG upsampling
+    passes. roi is an optional (x, y, width, height) region given as
+    fractions of the frame, e.g. the door area only. With refine, the
+    scaled-down frame only finds candidates: each coarse hit is detected
+    again in a full-resolution crop around it, and that crop is what gets
+    encoded.
+    """
+
+    def __init__(self, name="default", detect_width=DETECTION_WIDTH, upsample=DEFAULT_UPSAMPLE,
+                 model=DEFAULT_MODEL, roi=None, refine=False):
+        if roi is not None:
+            x, y, width, height = roi
+            # Compared as sums with a little slack: 1 - 0.8 is 0.19999999999999996 in floating point
+            if not (0 <= x < 1 and 0 <= y < 1 and 0 < width and 0 < height
+                    and x + width <= 1 + 1e-9 and y + height <= 1 + 1e-9):
+                raise ValueError(f"Profile {name!r}: roi {roi} must lie within the frame (fractions 0-1)")
+            roi = (x, y, min(width, 1 - x), min(height, 1 - y))
+        self.name = name
+        self.detect_width = detect_width
+        self.upsample = upsample
+        self.model = model
+        self.roi = roi
+        self.refine = refine
+        self.frames = 0
+        self.faces = 0
+        self.seconds = 0.0
+
+    @property
+    def client_width(self):
+        """Widest frame this profile makes use of, reported to clients as their detection width"""
+        width = self.detect_width / (self.roi[2] if self.roi else 1.0)
+        return int(round(width * (REFINE_FACTOR if self.refine else 1)))
+
+    def region_of(self, frame):
+        """(view of the region of interest, (x, y) offset of the view in the frame)"""
+        if self.roi is None:
+            return frame, (0, 0)
+        height, width = frame.shape[:2]
+        x, y, roi_width, roi_height = self.roi
+        left, top = int(x * width), int(y * height)
+        right, bottom = int(round((x + roi_width) * width)), int(round((y + roi_height) * height))
+        return frame[top:bottom, left:right], (left, top)
+
+    def record(self, started, faces):
+        self.frames += 1
+        self.faces += faces
+        self.seconds += time.perf_counter() - started
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "faces_per_frame": round(self.faces / self.frames, 2) if self.frames else 0.0,
+            "mean_ms": round(self.seconds / self.frames * 1000, 1) if self.frames else 0.0,
+            "detect_width": self.detect_width,
+            "upsample": self.upsample,
+            "refine": self.refine,
+        }
+
+
+# Used by sessions opened without a profile
+DEFAULT_PROFILE = DetectionProfile()
+
+
+class RecognitionSession:
+    """Per-connection state carried from one frame of a camera to the next"""
+
+    def __init__(self, profile=None, motion_gating=True, cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL,
+                 **motion_options):
+        self.profile = profile or DEFAULT_PROFILE
+        self.tracker = FaceTracker()
+        self.motion = MotionGate(**motion_options) if motion_gating else None
+        self.result_cache = ResultCache(cache_size, cache_ttl) if cache_size > 0 else None
+        # Result cache key of the frame being recognized, set by cached_result on a miss
+        self.cache_key = None
+        self.last_result = None
+        # Clock reading of the frame being recognized, set by cached_result
+        self.now = None
+
+    def cached_result(self, frame, gallery_version=0, now=None):
+        """A stored result flagged as cached, or None if the frame has to be recognized.
+
+        The previous result is reused if the scene has not changed since the
+        last processed frame, else the result cache is asked for a frame that
+        looked the same against the same gallery. now (time.monotonic() by
+        default) is the frame's time for the motion gate, the result cache
+        and the tracker, so recorded footage can run on video time.
+        """
+        self.now = time.monotonic() if now is None else now
+        self.cache_key = None
+        if isinstance(frame, FaceCrops):
+            # Crop uploads only arrive when the client saw faces, there is no scene to compare
+            return None
+        if (self.motion is not None and not self.motion.should_process(frame, self.now)
+                and self.last_result is not None):
+            return dict(self.last_result, cached=True)
+        if self.result_cache is None:
+            return None
+        self.cache_key = (difference_hash(frame), gallery_version)
+        result = self.result_cache.get(self.cache_key, self.now)
+        if result is None:
+            return None
+        self.cache_key = None
+        self.last_result = result
+        return dict(result, cached=True)
+
+    def remember(self, result):
+        """Store the result of the frame cached_result missed on"""
+        if self.cache_key is not None:
+            self.result_cache.put(self.cache_key, result, self.now)
+            self.cache_key = None
+
+    def summary(self):
+        stats = self.tracker.stats()
+        lines = []
+        if stats["faces_encoded"] or stats["faces_reused"]:
+            lines.append(f"🧠 Encoded {stats['faces_encoded']} faces, reused {stats['faces_reused']} from tracks, "
+                         f"committed {stats['commits']} identities")
+        if self.motion is not None:
+            stats = self.motion.stats()
+            lines.append(f"📉 Motion gate skipped {stats['frames_skipped']} of {stats['frames_checked']} frames")
+        if self.result_cache is not None:
+            stats = self.result_cache.stats()
+            lines.append(f"🗃️ Result cache: {stats['hits']} hits, {stats['misses']} misses, "
+                         f"{stats['evictions']} evictions, {stats['expired']} expired")
+        return "\n".join(lines) or None
+
+
+def faces_to_encode(session, face_locations):
+    """Indices of the faces the session's tracker cannot vouch for (all of them without a session)"""
+    if session is None:
+        return list(range(len(face_locations)))
+    return session.tracker.update(face_locations, session.now)
+
+
+def analyze_frame(rgb_small_frame, session=None):
+    """Detect faces and encode only those the session's tracker cannot vouch for.
+
+    Returns (face_locations, pending, face_encodings) where pending lists the
+    indices of face_locations that were encoded.
+    """
+    profile = session.profile if session is not None else DEFAULT_PROFILE
+    face_locations = detect_faces(rgb_small_frame, profile.upsample, profile.model)
+    pending = faces_to_encode(session, face_locations)
+    face_encodings = encode_faces(rgb_small_frame, [face_locations[i] for i in pending])
+    return face_locations, pending, face_encodings
+
+
+def crop_location(face_box, crop_region, crop_shape):
+    """Face box in (top, right, bottom, left) pixel coordinates of its crop image"""
+    top, right, bottom, left = face_box
+    x, y, width, height = crop_region
+    fx = crop_shape[1] / float(width or 1)
+    fy = crop_shape[0] / float(height or 1)
+    return (int(round((top - y) * fy)), int(round((right - x) * fx)),
+            int(round((bottom - y) * fy)), int(round((left - x) * fx)))
+
+
+def analyze_crops(face_crops, session=None):
+    """analyze_frame for client face crops: no detection, only the encoder runs.
+
+    Face locations are the client's boxes in its frame coordinates.
+    """
+    face_locations = [tuple(face_box) for face_box, _, _ in face_crops.crops]
+    pending = faces_to_encode(session, face_locations)
+    face_encodings = []
+    for i in pending:
+        face_box, crop_region, image = face_crops.crops[i]
+        rgb_crop = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        face_encodings.extend(encode_faces(rgb_crop, [crop_location(face_box, crop_region, image.shape)]))
+    return face_locations, pending, face_encodings
+
+
+def offset_locations(face_locations, scale, offset):
+    """Detection boxes of a region of interest in received frame coordinates"""
+    x, y = offset
+    return [(int(round(top * scale)) + y, int(round(right * scale)) + x,
+             int(round(bottom * scale)) + y, int(round(left * scale)) + x)
+            for (top, right, bottom, left) in face_locations]
+
+
+def refine_faces(frame, face_locations, model=DEFAULT_MODEL):
+    """Detect each coarse hit again in a full-resolution crop around it.
+
+    face_locations are in frame coordinates. Returns (face box in the frame,
+    RGB crop, face box in the crop) for each hit, keeping the coarse box when
+    the fine pass finds nothing.
+    """
+    height, width = frame.shape[:2]
+    refined = []
+    for top, right, bottom, left in face_locations:
+        pad_y, pad_x = int((bottom - top) * REFINE_PADDING), int((right - left) * REFINE_PADDING)
+        crop_top, crop_bottom = max(0, top - pad_y), min(height, bottom + pad_y)
+        crop_left, crop_right = max(0, left - pad_x), min(width, right + pad_x)
+        rgb_crop = cv2.cvtColor(frame[crop_top:crop_bottom, crop_left:crop_right], cv2.COLOR_BGR2RGB)
+        # The face is large in its crop, no upsampling needed
+        fine = detect_faces(rgb_crop, 0, model)
+        if fine:
+            box = max(fine, key=lambda b: (b[2] - b[0]) * (b[1] - b[3]))
+        else:
+            box = (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+        frame_box = (box[0] + crop_top, box[1] + crop_left, box[2] + crop_top, box[3] + crop_left)
+        refined.append((frame_box, rgb_crop, box))
+    return refined
+
+
+def analyze_refined(frame, rgb_small_frame, scale, offset, session=None):
+    """analyze_frame for coarse-to-fine profiles; face locations are in frame coordinates"""
+    profile = session.profile if session is not None else DEFAULT_PROFILE
+    coarse = offset_locations(detect_faces(rgb_small_frame, profile.upsample, profile.model), scale, offset)
+    refined = refine_faces(frame, coarse, profile.model)
+    face_locations = [frame_box for frame_box, _, _ in refined]
+    pending = faces_to_encode(session, face_locations)
+    face_encodings = []
+    for i in pending:
+        _, rgb_crop, box = refined[i]
+        face_encodings.extend(encode_faces(rgb_crop, [box]))
+    return face_locations, pending, face_encodings
+
+
+def analyze_upload(upload, session=None):
+    """Detect (unless the client sent crops) and encode a decoded upload.
+
+    Detection follows the session's DetectionProfile. Returns
+    (face_locations, pending, face_encodings, scale, frame_width) for
+    finish_frame.
+    """
+    if isinstance(upload, FaceCrops):
+        return (*analyze_crops(upload, session), 1.0, upload.frame_width)
+    profile = session.profile if session is not None else DEFAULT_PROFILE
+    started = time.perf_counter()
+    region, offset = profile.region_of(upload)
+    rgb_small_frame, scale = prepare_frame(region, profile.detect_width)
+    if profile.refine:
+        face_locations, pending, face_encodings = analyze_refined(upload, rgb_small_frame, scale, offset, session)
+        scale = 1.0
+    else:
+        face_locations, pending, face_encodings = analyze_frame(rgb_small_frame, session)
+        if offset != (0, 0):
+            face_locations, scale = offset_locations(face_locations, scale, offset), 1.0
+    profile.record(started, len(face_locations))
+    return face_locations, pending, face_encodings, scale, upload.shape[1]
+
+
+def finish_frame(session, face_locations, pending, recognized_names, scale=1.0, frame_width=0, distances=None):
+    """Merge fresh matches with identities reused from tracks into the result dict"""
+    if session is None:
+        return build_result(face_locations, recognized_names, scale, frame_width)
+    recognized_names = session.tracker.resolve(pending, recognized_names, distances, session.now)
+    session.last_result = build_result(face_locations, recognized_names, scale, frame_width)
+    # Lets add_feedback tell the client how wide a frame this camera's profile can use
+    session.last_result["detect_width"] = session.profile.client_width
+    session.remember(session.last_result)
+    return session.last_result
+
+
+def add_feedback(result, frame_seq, started, queue_depth):
+    """Copy of a result carrying the load figures clients use to pace their frames.
+
+    frame_seq is the connection's count of received frames when this one
+    arrived, started the time.perf_counter() value at which it was received.
+    """
+    return dict(result, frame_seq=frame_seq, queue_depth=queue_depth,
+                processing_ms=int((time.perf_counter() - started) * 1000),
+                detect_width=result.get("detect_width", DETECTION_WIDTH))
+
+
+class FrameRecognizer:
+    """Runs detection, encoding and matching inline in the calling thread"""
+
+    def __init__(self, gallery, session_options=None):
+        self.gallery = gallery
+        self.session_options = session_options or {}
+
+    def open_session(self, profile=None):
+        return RecognitionSession(profile, **self.session_options)
+
+    def close_session(self, session):
+        summary = session.summary()
+        if summary:
+            print(summary)
+
+    def update_gallery(self, gallery, changes=None):
+        # Swapping the reference is atomic; frames already matching keep the old snapshot
+        self.gallery = gallery
+
+    def queue_depth(self):
+        # Frames are recognized on the connection thread, nothing ever waits
+        return 0
+
+    def recognize_encoded(self, frame_data, session=None):
+        """Decode and recognize a received frame or crop upload, None if it cannot be decoded"""
+        frame = decode_upload(frame_data)
+        return None if frame is None else self.recognize(frame, session)
+
+    def recognize(self, frame, session=None, now=None):
+        if session is not None:
+            # Static and previously seen scenes skip detection entirely
+            cached = session.cached_result(frame, self.gallery.version, now)
+            if cached is not None:
+                return cached
+        face_locations, pending, face_encodings, scale, frame_width = analyze_upload(frame, session)
+        recognized_names, distances = match_faces(self.gallery, face_encodings)
+        return finish_frame(session, face_locations, pending, recognized_names, scale, frame_width, distances)
@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from metrics import registry
+
+CACHE_SIZE = 32  # Results remembered per connection
+CACHE_TTL = 5.0  # Seconds a cached result may be served before recognition runs again
+HASH_SIZE = 16  # Difference hash over a (HASH_SIZE + 1) x HASH_SIZE thumbnail, HASH_SIZE**2 bits
+
+
+def difference_hash(frame, hash_size=HASH_SIZE):
+    """Perceptual hash of a BGR frame: which thumbnail pixels are brighter than their left neighbour"""
+    small = cv2.resize(frame, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return np.packbits(gray[:, 1:] > gray[:, :-1]).tobytes()
+
+
+class ResultCache:
+    """Bounded LRU of recognition results keyed by (frame hash, gallery version).
+
+    A scene the camera returns to (a door closing again, a person stepping
+    out of view) hashes to a key seen before and gets its earlier result
+    back without detection or encoding. Keys include the gallery version so
+    enrolling or revoking someone invalidates every entry, and entries older
+    than ttl are dropped so an identity is never served indefinitely.
+    Counters are kept per cache and in the process-wide metrics.
+    """
+
+    def __init__(self, capacity=CACHE_SIZE, ttl=CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        entry = self.entries.get(key)
+        if entry is not None and now - entry[1] > self.ttl:
+            del self.entries[key]
+            self.expired += 1
+            registry.count("result_cache_expired")
+            entry = None
+        if entry is None:
+            self.misses += 1
+            registry.count("result_cache_misses")
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        registry.count("result_cache_hits")
+        return entry[0]
+
+    def put(self, key, result, now=None):
+        self.entries[key] = (result, time.monotonic() if now is None else now)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+            registry.count("result_cache_evictions")
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "expired": self.expired}
@@ -0,0 +1,160 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+from recognition import RecognitionSession, analyze_upload, decode_upload, finish_frame, match_faces
+
+MAX_BATCH_SIZE = 8
+MAX_BATCH_WAIT = 0.02  # Seconds to wait for more frames before running a partial batch
+
+
+class InferenceScheduler:
+    """Central inference thread shared by all camera connections.
+
+    Connection threads submit decoded frames and block on the returned future.
+    Frames are grouped into micro-batches of at most max_batch_size, waiting no
+    longer than max_wait for a batch to fill. Detection and encoding run per
+    frame, then every encoding in the batch is matched against the gallery in
+    one call and each result is routed back to its connection.
+    """
+
+    def __init__(self, gallery, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT, session_options=None):
+        self.gallery = gallery
+        self.session_options = session_options or {}
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.running = True
+
+        self.stats_lock = threading.Lock()
+        self.frames_processed = 0
+        self.batches_processed = 0
+        self.batch_sizes = Counter()
+        self.max_queue_depth = 0
+
+        self.thread = threading.Thread(target=self._run, name="inference-scheduler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def open_session(self, profile=None):
+        return RecognitionSession(profile, **self.session_options)
+
+    def close_session(self, session):
+        summary = session.summary()
+        if summary:
+            print(summary)
+
+    def submit(self, frame, session=None):
+        """Queue a decoded BGR frame or FaceCrops, returning a Future for its result dict"""
+        future = Future()
+        self.requests.put((frame, session, future))
+        depth = self.requests.qsize()
+        with self.stats_lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+        return future
+
+    def update_gallery(self, gallery, changes=None):
+        # Swapping the reference is atomic; a batch already running keeps the old snapshot
+        self.gallery = gallery
+
+    def queue_depth(self):
+        return self.requests.qsize()
+
+    def recognize(self, frame, session=None):
+        if session is not None:
+            # Unchanged frames are answered on the connection thread without queueing
+            cached = session.cached_result(frame, self.gallery.version)
+            if cached is not None:
+                return cached
+        return self.submit(frame, session).result()
+
+    def recognize_encoded(self, frame_data, session=None):
+        # Decoding stays on the connection thread so the scheduler only runs inference
+        frame = decode_upload(frame_data)
+        return None if frame is None else self.recognize(frame, session)
+
+    def stop(self):
+        self.running = False
+        self.requests.put(None)
+        self.thread.join()
+
+    def stats(self):
+        with self.stats_lock:
+            batches = self.batches_processed
+            return {
+                "queue_depth": self.requests.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "frames": self.frames_processed,
+                "batches": batches,
+                "mean_batch_size": self.frames_processed / batches if batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            }
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Re-queue the stop marker so the run loop sees it after this batch
+                self.requests.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while self.running:
+            item = self.requests.get()
+            if item is None:
+                break
+            self._process(self._collect_batch(item))
+
+        # Fail anything still queued so no connection waits forever
+        while True:
+            try:
+                item = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[2].set_exception(RuntimeError("Inference scheduler stopped"))
+
+    def _process(self, batch):
+        pending_frames = []
+        all_encodings = []
+        for frame, session, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                face_locations, pending, face_encodings, scale, frame_width = analyze_upload(frame, session)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            geometry = (scale, frame_width)
+            pending_frames.append((future, session, face_locations, pending, geometry, len(all_encodings)))
+            all_encodings.extend(face_encodings)
+
+        try:
+            # One gallery lookup for every face in the batch
+            all_names, all_distances = match_faces(self.gallery, all_encodings) if all_encodings else ([], [])
+        except Exception as e:
+            for future, _, _, _, _, _ in pending_frames:
+                future.set_exception(e)
+            return
+
+        for future, session, face_locations, pending, (scale, frame_width), start in pending_frames:
+            names = all_names[start:start + len(pending)]
+            distances = all_distances[start:start + len(pending)]
+            future.set_result(finish_frame(session, face_locations, pending, names, scale, frame_width, distances))
+
+        with self.stats_lock:
+            self.frames_processed += len(batch)
+            self.batches_processed += 1
+            self.batch_sizes[len(batch)] += 1
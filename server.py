@@ -1,10 +1,7 @@
 """
 import socket
-import struct
 import face_recognition
-import numpy as np
 import threading
-import cv2
 import json
 import ssl
 import os
@@ -208,12 +205,49 @@ import ssl
 import os
 import pickle
 import time
+import argparse
+import functools
+
+from access_log import AccessLogger, ACCESS_LOG_FILE
+from async_server import AsyncRecognitionServer, MAX_CONNECTIONS
+from detection_profiles import DetectionProfiles
+from enroll import ENCODINGS_FILE, load_compiled_database, names_path_for
+from face_index import load_or_build_index
+from gallery import FaceGallery
+from gallery_store import GalleryStore, RELOAD_POLL_INTERVAL
+from metrics import METRICS_PORT, MetricsServer, registry
+from motion import AREA_THRESHOLD, PIXEL_THRESHOLD
+from result_cache import CACHE_SIZE, CACHE_TTL
+from pipeline import ConnectionPipeline
+from protocol import FrameReader, PROTOCOL_PROBE, forwarded_camera, is_probe, negotiate, pack_hello
+from recognition import FrameRecognizer, add_feedback
+from scheduler import InferenceScheduler, MAX_BATCH_SIZE, MAX_BATCH_WAIT
+from worker_pool import RecognitionWorkerPool
 
 PORT = 9999
 DATABASE_FILE = "face_database.pkl"
+# Default of --index: "flat" for exact matching, "ivf" for approximate search on
+# large galleries, "identity" to shortlist people by centroid when each has many photos
+INDEX_KIND = "flat"
+INDEX_KINDS = ("flat", "ivf", "identity")
+STATS_INTERVAL = 30  # Seconds between metrics, scheduler and worker pool statistics reports
+
+# Background access log writer, started in main()
+access_logger = None
+# Per-camera detection settings, replaced in main() when --profiles is given
+detection_profiles = DetectionProfiles()
 
 def load_face_database():
     """Load the face database from file"""
+    # Database compiled by enroll.py: memory-mapped, so startup does not read or copy the matrix
+    if os.path.exists(ENCODINGS_FILE):
+        try:
+            encodings, names = load_compiled_database(ENCODINGS_FILE)
+            print(f"✅ Mapped compiled face database with {len(names)} encodings")
+            return encodings, names
+        except Exception as e:
+            print(f"❌ Error loading compiled face database: {e}")
+    
     if os.path.exists(DATABASE_FILE):
         try:
             with open(DATABASE_FILE, "rb") as f:
@@ -282,135 +316,248 @@ def load_from_image_files():
     print(f"✅ Loaded {success_count} faces from image files")
     return known_face_encodings, known_face_names
 
-def handle_client(conn, addr, known_face_encodings, known_face_names):
-    print(f"📥 Connection from {addr}")
-    data_buffer = b""
+def build_gallery(known_face_encodings, known_face_names, index_kind=INDEX_KIND):
+    """Build (or load) the search index for a face database and wrap both in a FaceGallery"""
+    index = load_or_build_index(DATABASE_FILE, known_face_encodings, kind=index_kind, labels=known_face_names)
+    return FaceGallery(known_face_encodings, known_face_names, index=index)
+
+def load_gallery(index_kind=INDEX_KIND):
+    """Load the face database and its search index into a FaceGallery"""
+    return build_gallery(*load_face_database(), index_kind=index_kind)
+
+def handle_result(result, addr, encoder):
+    """Log the access attempt for a recognized frame and build its framed response"""
+    recognized_names = result["recognized"]
+    access_granted = result["access_granted"]
+    
+    # Log access attempts (queued, written in batches by the access log thread)
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    started = time.perf_counter()
+    access_logger.log(access_granted, recognized_names, addr)
+    registry.observe("log_write", started)
+    registry.record_result(addr, result)
+    if access_granted:
+        # Here you would trigger your access control system
+        # For example, send a signal to unlock a door
+        # unlock_door()  # You would implement this function
+        pass
+    
+    # Respond with authentication result
+    response = dict(result, timestamp=timestamp)
+    
+    # Printing every frame costs time under load, --log-sample prints one frame in N
+    if registry.should_log():
+        print(f"✅ Faces Detected: {recognized_names}, Access: {'Granted' if access_granted else 'Denied'}")
+    # JSON, or the compact binary format for clients that negotiated it
+    return encoder.encode(response)
+
+def handle_client(conn, addr, recognizer):
+    reader = FrameReader(conn)
+    session = None
+    encoder = None
+    frame_seq = 0
     while True:
         try:
-            # Read frame size (4 bytes)
-            while len(data_buffer) < 4:
-                packet = conn.recv(4096)
-                if not packet:
-                    print("❌ Disconnected")
-                    return
-                data_buffer += packet
-            
-            # Extract frame size and remove from buffer
-            frame_size = struct.unpack(">L", data_buffer[:4])[0]
-            data_buffer = data_buffer[4:]
-            
-            # Read complete frame
-            while len(data_buffer) < frame_size:
-                data_buffer += conn.recv(4096)
-            
-            # Extract frame data and update buffer
-            frame_data = data_buffer[:frame_size]
-            data_buffer = data_buffer[frame_size:]
-            
-            # Decode frame
-            frame_array = np.frombuffer(frame_data, dtype=np.uint8)
-            frame = cv2.imdecode(frame_array, cv2.IMREAD_COLOR)
-            
-            if frame is None:
+            # Read the next length-prefixed frame into the reusable receive buffer
+            # (recv time includes waiting for the camera to send it)
+            received = time.perf_counter()
+            frame_data = reader.read_message()
+            registry.observe("recv", received)
+            if frame_data is None:
+                print("❌ Disconnected")
+                break
+            
+            # The first message may be a health probe or a protocol handshake instead of a frame
+            if encoder is None:
+                if is_probe(frame_data):
+                    conn.sendall(pack_hello(PROTOCOL_PROBE))
+                    break
+                # Behind balancer.py, log and pick the profile by the camera's own address
+                addr = forwarded_camera(frame_data) or addr
+                print(f"📥 Connection from {addr}")
+                session = recognizer.open_session(detection_profiles.for_camera(addr))
+                encoder, reply = negotiate(frame_data)
+                if reply is not None:
+                    conn.sendall(reply)
+                    continue
+            
+            # Decode frame, then detect, encode and match faces
+            frame_seq += 1
+            started = time.perf_counter()
+            result = recognizer.recognize_encoded(frame_data, session)
+            
+            if result is None:
                 print("⚠️ Frame decoding failed, skipping frame.")
                 continue
             
-            # Process for facial recognition (scale down for performance)
-            small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-            rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-            
-            # Find faces and encode them
-            face_locations = face_recognition.face_locations(rgb_small_frame)
-            face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-            
-            recognized_names = []
-            access_granted = False
-            # Convert face locations to the original frame size for better visualization
-            scaled_face_locations = []
-            
-            # Skip recognition if no known faces are loaded
-            if len(known_face_encodings) == 0:
-                print("⚠️ No face database loaded, skipping recognition")
-                for (top, right, bottom, left) in face_locations:
-                    # Scale back to original frame size
-                    scaled_face_locations.append({
-                        "top": top * 4,
-                        "right": right * 4,
-                        "bottom": bottom * 4,
-                        "left": left * 4
-                    })
-            else:
-                for i, face_encoding in enumerate(face_encodings):
-                    matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-                    name = "Unknown"
-                    
-                    if True in matches:
-                        face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-                        best_match_index = np.argmin(face_distances)
-                        if matches[best_match_index]:
-                            name = known_face_names[best_match_index]
-                            access_granted = True
-                    
-                    recognized_names.append(name)
-                    
-                    # Scale back to original frame size
-                    top, right, bottom, left = face_locations[i]
-                    scaled_face_locations.append({
-                        "top": top * 4,
-                        "right": right * 4,
-                        "bottom": bottom * 4,
-                        "left": left * 4
-                    })
-            
-            # Log access attempts
-            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-            if access_granted:
-                # Log successful access
-                with open("access_log.txt", "a") as log_file:
-                    recognized_names_str = ", ".join(recognized_names) or "Unknown"
-                    log_file.write(f"{timestamp}: Access GRANTED for {recognized_names_str} from {addr}\n")
-                
-                # Here you would trigger your access control system
-                # For example, send a signal to unlock a door
-                # unlock_door()  # You would implement this function
-            else:
-                # Log failed access attempt
-                with open("access_log.txt", "a") as log_file:
-                    log_file.write(f"{timestamp}: Access DENIED for unknown person from {addr}\n")
-            
-            # Respond with authentication result
-            response = {
-                "faces_detected": len(face_locations),
-                "recognized": recognized_names,
-                "access_granted": access_granted,
-                "timestamp": timestamp,
-                "face_locations": scaled_face_locations  # Send face locations for client-side visualization
-            }
-            
-            response_bytes = json.dumps(response).encode()
-            size_bytes = struct.pack(">L", len(response_bytes))
-            conn.sendall(size_bytes + response_bytes)
-            
-            print(f"✅ Faces Detected: {recognized_names}, Access: {'Granted' if access_granted else 'Denied'}")
+            # Report load so the client can adapt its frame rate and quality
+            result = add_feedback(result, frame_seq, started, recognizer.queue_depth())
+            response = handle_result(result, addr, encoder)
+            sending = time.perf_counter()
+            conn.sendall(response)
+            registry.observe("sendall", sending)
             
         except Exception as e:
             print(f"💥 Error: {e}")
             break
     
+    if session is not None:
+        recognizer.close_session(session)
+    registry.close_connection(addr)
+    access_logger.end_camera(addr)
     conn.close()
 
+def handle_client_pipelined(conn, addr, recognizer):
+    """Like handle_client, but receiving overlaps inference and stale frames are dropped"""
+    try:
+        first_message = FrameReader(conn).read_message()
+        if first_message is not None and is_probe(first_message):
+            conn.sendall(pack_hello(PROTOCOL_PROBE))
+            first_message = None
+    except Exception as e:
+        print(f"💥 Error: {e}")
+        first_message = None
+    if first_message is None:
+        conn.close()
+        return
+    addr = forwarded_camera(first_message) or addr
+    print(f"📥 Connection from {addr}")
+    ConnectionPipeline(conn, addr, recognizer, handle_result, detection_profiles.for_camera(addr),
+                       first_message=bytes(first_message)).run()
+    registry.close_connection(addr)
+    access_logger.end_camera(addr)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Facial recognition security server")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--batch", action="store_true",
+                      help="Run inference on a central scheduler that batches frames across connections")
+    mode.add_argument("--workers", type=int, nargs="?", const=os.cpu_count(), default=0,
+                      help="Run recognition in N worker processes (default: one per CPU core)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Pipeline each connection: receive while recognizing, keep only the latest frame")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="Serve connections from an asyncio event loop instead of one thread each")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS,
+                        help="Connection cap for the asyncio server")
+    parser.add_argument("--no-motion-gate", action="store_true",
+                        help="Run detection on every frame, even when the scene has not changed")
+    parser.add_argument("--motion-pixel-threshold", type=int, default=PIXEL_THRESHOLD,
+                        help="Gray-level difference for a thumbnail pixel to count as changed")
+    parser.add_argument("--motion-area-threshold", type=float, default=AREA_THRESHOLD,
+                        help="Fraction of changed thumbnail pixels needed to run detection")
+    parser.add_argument("--result-cache-size", type=int, default=CACHE_SIZE,
+                        help="Recognition results remembered per connection by frame hash (0 disables the cache)")
+    parser.add_argument("--result-cache-ttl", type=float, default=CACHE_TTL,
+                        help="Seconds a cached recognition result may be served")
+    parser.add_argument("--reload-interval", type=float, default=RELOAD_POLL_INTERVAL,
+                        help="Seconds between checks for face database changes to hot-reload (0 disables)")
+    parser.add_argument("--access-db", default=None,
+                        help="Also record access events in this SQLite database for range queries")
+    parser.add_argument("--profiles", default=None,
+                        help="JSON file of per-camera detection profiles (width, upsampling, region, coarse-to-fine)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Local port of the Prometheus text metrics endpoint (0 disables it)")
+    parser.add_argument("--log-sample", type=int, default=1,
+                        help="Print the result of one frame in N (0 prints none); the metrics count every frame")
+    parser.add_argument("--index", choices=INDEX_KINDS, default=INDEX_KIND,
+                        help="Face search index: exact (flat), approximate k-means (ivf), or per-person shortlists "
+                             "(identity)")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE,
+                        help="Largest number of frames processed in one batch")
+    parser.add_argument("--max-batch-wait", type=float, default=MAX_BATCH_WAIT,
+                        help="Seconds to wait for a batch to fill before running it")
+    return parser.parse_args()
+
+def report_stats(name, source):
+    """Periodically print statistics from a component exposing stats()"""
+    while True:
+        time.sleep(STATS_INTERVAL)
+        print(f"📊 {name}: {json.dumps(source.stats())}")
+
+def create_recognizer(args, gallery):
+    """Pick where recognition runs: inline, on the batch scheduler or in worker processes"""
+    session_options = {
+        "motion_gating": not args.no_motion_gate,
+        "pixel_threshold": args.motion_pixel_threshold,
+        "area_threshold": args.motion_area_threshold,
+        "cache_size": args.result_cache_size,
+        "cache_ttl": args.result_cache_ttl,
+    }
+    if args.workers:
+        # Each worker loads its own gallery; the parent has already built and saved the index
+        # The index kind travels with the loader, workers may be spawned without the parent's arguments
+        gallery_loader = functools.partial(load_gallery, index_kind=args.index)
+        recognizer = RecognitionWorkerPool(gallery_loader, args.workers, session_options=session_options,
+                                           log_sample=args.log_sample)
+        name = "Worker pool"
+        print(f"🧵 Started {recognizer.num_workers} recognition worker processes")
+    elif args.batch:
+        recognizer = InferenceScheduler(gallery, args.max_batch_size, args.max_batch_wait, session_options)
+        name = "Scheduler"
+        print(f"🧮 Batched inference enabled (max batch {args.max_batch_size}, max wait {args.max_batch_wait}s)")
+    else:
+        return FrameRecognizer(gallery, session_options)
+    
+    stats_thread = threading.Thread(target=report_stats, args=(name, recognizer))
+    stats_thread.daemon = True
+    stats_thread.start()
+    return recognizer
+
 def main():
+    global access_logger, detection_profiles
+    args = parse_args()
+    access_logger = AccessLogger(ACCESS_LOG_FILE, sqlite_path=args.access_db)
+    registry.log_sample = args.log_sample
     try:
         print("🔍 Starting facial recognition security system...")
         
-        # Load face database
-        known_face_encodings, known_face_names = load_face_database()
+        # Stage histograms and per-connection counters, scraped locally and summarized periodically
+        if args.metrics_port:
+            metrics_server = MetricsServer(registry, args.metrics_port)
+            metrics_server.start()
+            print(f"📈 Metrics at http://127.0.0.1:{args.metrics_port}/metrics")
+        stats_thread = threading.Thread(target=report_stats, args=("Metrics", registry))
+        stats_thread.daemon = True
+        stats_thread.start()
+        
+        # Load face database; the store swaps in new snapshots when the files change
+        gallery_store = GalleryStore(load_face_database, functools.partial(build_gallery, index_kind=args.index),
+                                     [ENCODINGS_FILE, names_path_for(ENCODINGS_FILE), DATABASE_FILE],
+                                     args.reload_interval)
+        gallery = gallery_store.current
         
-        if len(known_face_encodings) > 0:
-            print(f"✅ Loaded {len(known_face_encodings)} faces into the database")
+        if len(gallery) > 0:
+            print(f"✅ Loaded {len(gallery)} faces into the database")
         else:
             print("⚠️ No faces loaded. The system will run but won't recognize anyone.")
-            print("   Run the database management tool to add faces.")
+            print("   Run 'python enroll.py faces/' to add faces.")
+        
+        if args.profiles:
+            detection_profiles = DetectionProfiles.load(args.profiles)
+            print(f"🎯 Loaded {len(detection_profiles.profiles)} detection profiles for "
+                  f"{len(detection_profiles.cameras)} cameras from {args.profiles}")
+            stats_thread = threading.Thread(target=report_stats, args=("Detection profiles", detection_profiles))
+            stats_thread.daemon = True
+            stats_thread.start()
+        
+        recognizer = create_recognizer(args, gallery)
+        gallery_store.subscribe(recognizer.update_gallery)
+        if args.reload_interval > 0:
+            gallery_store.start_watching()
+            print("👀 Watching the face database for changes (send SIGHUP to reload now)")
+        
+        if args.asyncio:
+            async_server = AsyncRecognitionServer(recognizer, handle_result, args.max_connections,
+                                                  profiles=detection_profiles,
+                                                  end_connection=access_logger.end_camera)
+            stats_thread = threading.Thread(target=report_stats, args=("Async server", async_server))
+            stats_thread.daemon = True
+            stats_thread.start()
+            async_server.run(PORT)
+            return
+        
+        client_handler = handle_client_pipelined if args.pipeline else handle_client
         
         # Create server socket
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -429,7 +576,7 @@ def main():
             conn, addr = server_socket.accept()
             # For secure connection:
             # conn, addr = wrapped_socket.accept()
-            client_thread = threading.Thread(target=handle_client, args=(conn, addr, known_face_encodings, known_face_names))
+            client_thread = threading.Thread(target=client_handler, args=(conn, addr, recognizer))
             client_thread.daemon = True
             client_thread.start()
             
@@ -440,6 +587,13 @@ def main():
     finally:
         if 'server_socket' in locals():
             server_socket.close()
+        if 'gallery_store' in locals():
+            gallery_store.stop()
+        if 'metrics_server' in locals():
+            metrics_server.stop()
+        if 'recognizer' in locals() and hasattr(recognizer, "stop"):
+            recognizer.stop()
+        access_logger.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
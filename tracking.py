@@ -0,0 +1,169 @@
+import itertools
+import time
+from collections import Counter, deque
+
+IOU_THRESHOLD = 0.3  # Minimum overlap to associate a detection with an existing track
+REENCODE_IOU = 0.5  # A face that moved this far from where it was last encoded is identified again
+VOTE_WINDOW = 5  # Most recent matches of a track that vote on its identity
+COMMIT_VOTES = 3  # Agreeing votes in the window needed to commit to an identity
+COMMIT_DISTANCE = 0.5  # Mean match distance those votes need to commit to a known person
+COMMIT_TTL = 10.0  # Seconds a committed identity is reused without encoding the face
+UNKNOWN_TTL = 2.0  # "Unknown" and weak matches are re-checked sooner, the person may turn towards the camera
+MAX_MISSED = 5  # Frames a track survives without a matching detection
+
+
+def iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    intersection = max(0, bottom - top) * max(0, right - left)
+    if intersection == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return intersection / float(area_a + area_b - intersection)
+
+
+class Track:
+    def __init__(self, track_id, box, window=VOTE_WINDOW):
+        self.track_id = track_id
+        self.box = box
+        self.encoded_box = None
+        # (name, match distance) of the latest encodings
+        self.votes = deque(maxlen=window)
+        self.name = None
+        self.committed_at = None
+        self.commit_ttl = 0.0
+        self.missed = 0
+
+
+class FaceTracker:
+    """Associates faces between frames of one connection by bounding box overlap.
+
+    Each track votes on its identity with the matches of its latest
+    encodings. Until the window holds commit_votes agreeing votes the face
+    is encoded on every processed frame and shown under the leading name.
+    Once the vote is decided the identity is committed and the face is not
+    encoded again until the commitment expires: after commit_ttl for a
+    confident match (mean distance within commit_distance), after the
+    shorter unknown_ttl for "Unknown" and weak matches.
+
+    A track's identity is forgotten, and the face identified from scratch,
+    when the track reappears after missed frames or when its box moves or
+    resizes beyond reencode_iou of where it was last encoded: the face
+    there may belong to someone else. update() returns the indices of
+    detections that need the dlib encoder.
+    """
+
+    def __init__(self, iou_threshold=IOU_THRESHOLD, reencode_iou=REENCODE_IOU, window=VOTE_WINDOW,
+                 commit_votes=COMMIT_VOTES, commit_distance=COMMIT_DISTANCE, commit_ttl=COMMIT_TTL,
+                 unknown_ttl=UNKNOWN_TTL, max_missed=MAX_MISSED):
+        self.iou_threshold = iou_threshold
+        self.reencode_iou = reencode_iou
+        self.window = window
+        self.commit_votes = commit_votes
+        self.commit_distance = commit_distance
+        self.commit_ttl = commit_ttl
+        self.unknown_ttl = unknown_ttl
+        self.max_missed = max_missed
+        self.tracks = []
+        self.current = []
+        self.track_ids = itertools.count()
+        self.faces_encoded = 0
+        self.faces_reused = 0
+        self.commits = 0
+
+    def _associate(self, face_locations):
+        """Greedy highest-IoU matching of detections to existing tracks"""
+        pairs = sorted(
+            ((iou(track.box, box), t, d)
+             for t, track in enumerate(self.tracks)
+             for d, box in enumerate(face_locations)),
+            reverse=True)
+        matched_tracks, assignment = set(), {}
+        for overlap, t, d in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in matched_tracks or d in assignment:
+                continue
+            matched_tracks.add(t)
+            assignment[d] = self.tracks[t]
+        return assignment
+
+    def _forget(self, track):
+        track.votes.clear()
+        track.name = None
+        track.committed_at = None
+
+    def _needs_encoding(self, track, now):
+        if track.committed_at is None:
+            return True
+        if iou(track.box, track.encoded_box) < self.reencode_iou:
+            self._forget(track)
+            return True
+        if now - track.committed_at <= track.commit_ttl:
+            return False
+        # The commitment expired: keep showing the name while a fresh vote runs
+        track.committed_at = None
+        track.votes.clear()
+        return True
+
+    def _vote(self, track, name, distance, now):
+        track.votes.append((name, distance))
+        # Ties go to the most recent name
+        counts = Counter(vote for vote, _ in reversed(track.votes))
+        leader, count = counts.most_common(1)[0]
+        track.name = leader
+        if count < self.commit_votes:
+            return
+        leader_distances = [d for vote, d in track.votes if vote == leader]
+        confident = leader != "Unknown" and sum(leader_distances) / len(leader_distances) <= self.commit_distance
+        track.commit_ttl = self.commit_ttl if confident else self.unknown_ttl
+        track.committed_at = now
+        self.commits += 1
+
+    def update(self, face_locations, now=None):
+        """Associate this frame's detections; returns indices of faces to encode"""
+        now = time.monotonic() if now is None else now
+        assignment = self._associate(face_locations)
+
+        current = []
+        for d, box in enumerate(face_locations):
+            track = assignment.get(d)
+            if track is None:
+                track = Track(next(self.track_ids), box, self.window)
+                self.tracks.append(track)
+            elif track.missed:
+                # Detection lost the face for a while, whoever is there now has to be identified again
+                self._forget(track)
+            track.box = box
+            track.missed = 0
+            current.append(track)
+
+        seen = {id(track) for track in current}
+        for track in self.tracks:
+            if id(track) not in seen:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+        self.current = current
+
+        pending = [d for d, track in enumerate(current) if self._needs_encoding(track, now)]
+        for d in pending:
+            current[d].encoded_box = current[d].box
+        self.faces_encoded += len(pending)
+        self.faces_reused += len(current) - len(pending)
+        return pending
+
+    def resolve(self, pending, names, distances=None, now=None):
+        """Count the encoded faces' matches as votes; returns the name shown for every face"""
+        now = time.monotonic() if now is None else now
+        if distances is None:
+            # Without distances every known match counts as a confident one
+            distances = [0.0] * len(names)
+        for d, name, distance in zip(pending, names, distances):
+            self._vote(self.current[d], name, distance, now)
+        return [track.name or "Unknown" for track in self.current]
+
+    def stats(self):
+        return {"tracks": len(self.tracks), "faces_encoded": self.faces_encoded,
+                "faces_reused": self.faces_reused, "commits": self.commits}
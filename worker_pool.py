@@ -0,0 +1,300 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+SLOT_SIZE = 2 * 1024 * 1024  # Bytes reserved per in-flight frame in shared memory
+SLOTS_PER_WORKER = 4
+WATCH_INTERVAL = 1.0  # Seconds the watchdog waits on the workers before checking for shutdown
+
+
+def _worker_main(gallery_loader, session_options, log_sample, shm_name, slot_size, tasks, results):
+    """Recognition worker process: load the gallery once, then serve frames"""
+    # Imported here so the parent process does not need dlib loaded to start the pool
+    from metrics import registry
+    from recognition import FrameRecognizer
+
+    # Per-frame warnings printed in the worker follow the server's --log-sample
+    registry.log_sample = log_sample
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    recognizer = FrameRecognizer(gallery_loader(), session_options)
+    # Per-connection state (face tracks) of the sessions pinned to this worker
+    sessions = {}
+    results.put(("ready", os.getpid(), None))
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            if task[0] == "open":
+                # The session's detection profile travels with it to the worker
+                sessions[task[1]] = recognizer.open_session(task[2])
+                continue
+            if task[0] == "close":
+                session = sessions.pop(task[1], None)
+                if session is not None:
+                    recognizer.close_session(session)
+                continue
+            if task[0] == "gallery":
+                # Apply the parent's incremental update, or reload after a full rebuild
+                changes = task[1]
+                try:
+                    if changes is None:
+                        gallery = gallery_loader()
+                        # Keep versions increasing so cached results of the old gallery are never served
+                        gallery.version = recognizer.gallery.version + 1
+                    else:
+                        # Removed rows come as name/encoding pairs: a replacement worker loaded a
+                        # compacted gallery, so its row ids differ from the parent's
+                        added_encodings, added_names, removed_names, removed_encodings = changes
+                        removed_ids = recognizer.gallery.row_ids(removed_names, removed_encodings)
+                        gallery = recognizer.gallery.apply(added_encodings, added_names, removed_ids)
+                    recognizer.update_gallery(gallery)
+                except Exception as e:
+                    # Keep serving the old gallery rather than taking the worker down
+                    print(f"❌ Worker {os.getpid()} could not update the face gallery: {type(e).__name__}: {e}")
+                continue
+
+            _, task_id, session_id, slot, length, inline_data = task
+            try:
+                session = None
+                if session_id is not None:
+                    session = sessions.get(session_id)
+                    if session is None:
+                        session = sessions[session_id] = recognizer.open_session()
+                if inline_data is not None:
+                    frame_data = inline_data
+                else:
+                    offset = slot * slot_size
+                    frame_data = shm.buf[offset:offset + length]
+                try:
+                    result = recognizer.recognize_encoded(frame_data, session)
+                finally:
+                    # Release the view before the slot is handed back to the parent
+                    if isinstance(frame_data, memoryview):
+                        frame_data.release()
+                results.put((task_id, result, None))
+            except Exception as e:
+                results.put((task_id, None, f"{type(e).__name__}: {e}"))
+    finally:
+        shm.close()
+
+
+class WorkerSession:
+    """Handle for a connection pinned to one worker, which keeps its state"""
+
+    def __init__(self, session_id, worker):
+        self.session_id = session_id
+        self.worker = worker
+
+
+class RecognitionWorkerPool:
+    """Recognition spread over worker processes to use every CPU core.
+
+    Each worker loads the face gallery once at startup. Connection threads copy
+    received frames into a slot of a shared memory block, so frame bytes are
+    never pickled; only the slot number travels through the task queue. Frames
+    are decoded, detected, encoded and matched entirely inside the workers.
+    Every connection session is pinned to one worker so its per-connection
+    state lives next to the frames that use it.
+
+    A watchdog thread waits on the worker processes. When one dies (a dlib
+    crash, the OOM killer), the frames it had been given fail with
+    RuntimeError, their shared memory slots are freed, and a fresh worker
+    takes its place. Sessions pinned to it keep their detection profile
+    but start with new face tracks.
+    """
+
+    def __init__(self, gallery_loader, num_workers=None, slot_size=SLOT_SIZE, slots=None, session_options=None,
+                 log_sample=1):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.slot_size = slot_size
+        num_slots = slots or self.num_workers * SLOTS_PER_WORKER
+
+        self.shm = shared_memory.SharedMemory(create=True, size=slot_size * num_slots)
+        self.free_slots = queue.Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+
+        self.context = multiprocessing.get_context()
+        self.gallery_loader = gallery_loader
+        self.session_options = session_options
+        self.log_sample = log_sample
+        self.task_queues = [self.context.Queue() for _ in range(self.num_workers)]
+        self.results = self.context.Queue()
+        # task id -> (future, slot, worker index); also guards task_queues and workers
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.task_ids = itertools.count()
+        self.session_ids = itertools.count()
+        # Profiles of open sessions, sent again to a worker that replaces a dead one
+        self.session_profiles = {}
+        self.frames_processed = 0
+        self.inline_frames = 0
+        self.restarted_workers = 0
+        self.stopping = False
+
+        self.workers = [self._start_worker(tasks) for tasks in self.task_queues]
+
+        # Wait until every worker has its gallery loaded before accepting frames
+        for _ in range(self.num_workers):
+            self.results.get()
+
+        self.dispatcher = threading.Thread(target=self._dispatch_results, name="worker-results")
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+        self.watchdog = threading.Thread(target=self._watch_workers, name="worker-watchdog")
+        self.watchdog.daemon = True
+        self.watchdog.start()
+
+    def _start_worker(self, tasks):
+        worker = self.context.Process(target=_worker_main,
+                                      args=(self.gallery_loader, self.session_options, self.log_sample,
+                                            self.shm.name, self.slot_size, tasks, self.results))
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    def open_session(self, profile=None):
+        session_id = next(self.session_ids)
+        session = WorkerSession(session_id, session_id % self.num_workers)
+        if profile is not None:
+            with self.pending_lock:
+                self.session_profiles[session_id] = profile
+                self.task_queues[session.worker].put(("open", session_id, profile))
+        return session
+
+    def close_session(self, session):
+        with self.pending_lock:
+            self.session_profiles.pop(session.session_id, None)
+            self.task_queues[session.worker].put(("close", session.session_id))
+
+    def submit(self, frame_data, session=None):
+        """Queue received frame bytes, returning a Future for the result dict (None if undecodable)"""
+        future = Future()
+        task_id = next(self.task_ids)
+        length = len(frame_data)
+        if session is not None:
+            worker, session_id = session.worker, session.session_id
+        else:
+            worker, session_id = task_id % self.num_workers, None
+
+        if length <= self.slot_size:
+            # Blocks while every slot is in flight, which back-pressures the connections
+            slot = self.free_slots.get()
+            offset = slot * self.slot_size
+            self.shm.buf[offset:offset + length] = frame_data
+            task = ("frame", task_id, session_id, slot, length, None)
+        else:
+            # Oversized frames fall back to being pickled through the queue
+            slot = None
+            task = ("frame", task_id, session_id, None, length, bytes(frame_data))
+
+        with self.pending_lock:
+            self.pending[task_id] = (future, slot, worker)
+            if slot is None:
+                self.inline_frames += 1
+            # Under the lock so a frame never lands in the queue of a worker being replaced
+            self.task_queues[worker].put(task)
+        return future
+
+    def recognize_encoded(self, frame_data, session=None):
+        return self.submit(frame_data, session).result()
+
+    def update_gallery(self, gallery, changes=None):
+        """Have every worker apply a gallery update between two of its frames"""
+        if changes is not None:
+            added_encodings, added_names, removed_ids = changes
+            # gallery still holds the masked rows, so they can be named for the workers to find
+            removed_names = [gallery.names[i] for i in removed_ids]
+            removed_encodings = gallery.encodings[list(removed_ids)]
+            changes = (added_encodings, added_names, removed_names, removed_encodings)
+        with self.pending_lock:
+            for tasks in self.task_queues:
+                tasks.put(("gallery", changes))
+
+    def queue_depth(self):
+        # Frames beyond the one each worker is busy with are waiting in a task queue
+        with self.pending_lock:
+            return max(0, len(self.pending) - self.num_workers)
+
+    def _dispatch_results(self):
+        while True:
+            task_id, result, error = self.results.get()
+            if task_id is None:
+                break
+            if task_id == "ready":
+                # A replacement worker finished loading the gallery
+                continue
+            with self.pending_lock:
+                entry = self.pending.pop(task_id, None)
+                if entry is None:
+                    # Already failed by the watchdog when its worker died
+                    continue
+                future, slot, _ = entry
+                self.frames_processed += 1
+            if slot is not None:
+                self.free_slots.put(slot)
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(result)
+
+    def _watch_workers(self):
+        while not self.stopping:
+            with self.pending_lock:
+                sentinels = {worker.sentinel: i for i, worker in enumerate(self.workers)}
+            for sentinel in wait(list(sentinels), timeout=WATCH_INTERVAL):
+                if not self.stopping:
+                    self._replace_worker(sentinels[sentinel])
+
+    def _replace_worker(self, index):
+        """Fail the frames of a dead worker and start a new one in its place"""
+        dead = self.workers[index]
+        dead.join()
+        print(f"💥 Recognition worker {dead.pid} died (exit code {dead.exitcode}), starting a new one")
+        with self.pending_lock:
+            # Frames still queued for the dead worker go down with it
+            self.task_queues[index] = tasks = self.context.Queue()
+            self.workers[index] = self._start_worker(tasks)
+            for session_id, profile in self.session_profiles.items():
+                if session_id % self.num_workers == index:
+                    tasks.put(("open", session_id, profile))
+            failed = [task_id for task_id, (_, _, worker) in self.pending.items() if worker == index]
+            failed = [self.pending.pop(task_id) for task_id in failed]
+            self.restarted_workers += 1
+        for future, slot, _ in failed:
+            if slot is not None:
+                self.free_slots.put(slot)
+            future.set_exception(RuntimeError(f"Recognition worker {dead.pid} died"))
+
+    def stats(self):
+        with self.pending_lock:
+            return {
+                "workers": self.num_workers,
+                "alive_workers": sum(worker.is_alive() for worker in self.workers),
+                "restarted_workers": self.restarted_workers,
+                "in_flight": len(self.pending),
+                "free_slots": self.free_slots.qsize(),
+                "frames": self.frames_processed,
+                "inline_frames": self.inline_frames,
+            }
+
+    def stop(self):
+        self.stopping = True
+        for tasks in self.task_queues:
+            tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.results.put((None, None, None))
+        self.dispatcher.join(timeout=5)
+        self.shm.close()
+        self.shm.unlink()